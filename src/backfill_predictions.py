@@ -0,0 +1,266 @@
+"""
+Backfill of the predictions feature group, e.g. for monitoring: predicts the
+rides of every hour in a date range for all locations, as the hourly
+inference pipeline would have, from a single read of the time-series.
+
+    python src/backfill_predictions.py --from-date 2023-01-01 [--to-date 2023-01-31T23:00] [--n-jobs 4]
+
+Every hour is inserted exactly once: the hours already inserted are recorded
+in a checkpoint file in BACKFILL_DIR, so an interrupted backfill resumes
+where it stopped when run again with the same dates.
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from paths import BACKFILL_DIR
+from timing import StageTimer
+
+# set once per worker process by `_init_worker`
+_worker_model = None
+_worker_rides = None
+
+
+def get_ts_array(
+    ts_data: pd.DataFrame,
+    from_date: datetime,
+    to_date: datetime,
+    n_features: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Time-series of the `n_features` hours before `from_date` until the hour
+    before `to_date` as a dense (n_locations, n_hours) float32 array, and the
+    sorted location ids of its rows.
+
+    Column `i` of the array is the hour `i` after the first one, so the
+    window of hours `k..k+n_features-1` holds the features of the hour
+    `from_date + k hours`, exactly as `inference.transform_ts_data_into_features`
+    builds them for that hour.
+    """
+    from inference import _check_ts_data_is_complete
+
+    expected_hours = pd.date_range(
+        from_date - timedelta(hours=n_features),
+        to_date - timedelta(hours=1),
+        freq='H'
+    )
+    ts_data = ts_data[ts_data.pickup_hour.between(expected_hours[0], expected_hours[-1])]
+    ts_data = ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'])
+    location_ids = ts_data['pickup_location_id'].unique()
+
+    n_hours = len(expected_hours)
+    is_complete = len(ts_data) == n_hours * len(location_ids) and (
+        ts_data['pickup_hour'].values.reshape(len(location_ids), n_hours)
+        == expected_hours.values
+    ).all()
+    if not is_complete:
+        _check_ts_data_is_complete(ts_data, expected_hours)
+
+    rides = ts_data['rides'].to_numpy(dtype=np.float32).reshape(len(location_ids), n_hours)
+    return rides, location_ids
+
+
+def get_lags(rides: np.ndarray, first_hour: int, n_hours: int, n_lags: int) -> np.ndarray:
+    """
+    (n_hours * n_locations, n_lags) matrix with the features of the hours
+    `first_hour..first_hour+n_hours-1` of `get_ts_array`, hour after hour,
+    all locations in each. The windows are strided views of `rides`, copied
+    only once into the result.
+    """
+    windows = sliding_window_view(rides, n_lags, axis=1)[:, first_hour:first_hour + n_hours]
+    return windows.transpose(1, 0, 2).reshape(-1, n_lags)
+
+
+def _init_worker(model, rides_path: Path):
+    global _worker_model, _worker_rides
+    _worker_model = model
+    # all the workers share the pages of the same file
+    _worker_rides = np.load(rides_path, mmap_mode='r')
+
+
+def _predict_hours(
+    first_hour: int,
+    n_hours: int,
+    location_ids: np.ndarray,
+    pickup_hour: pd.DatetimeIndex,
+) -> np.ndarray:
+    """Predictions of a batch of hours, in the order of `get_lags`"""
+    lags = get_lags(_worker_rides, first_hour, n_hours, _worker_model.n_lags)
+    return _worker_model.predict_array(
+        lags,
+        np.tile(location_ids, n_hours),
+        pickup_hour.repeat(len(location_ids)),
+    )
+
+
+def _load_checkpoint(path: Path) -> Set[str]:
+    """Pickup hours already inserted, in ISO format"""
+    if not path.exists():
+        return set()
+    return set(json.loads(path.read_text())['inserted'])
+
+
+def _save_checkpoint(path: Path, inserted: Set[str]):
+    # write and rename, so an interruption never leaves a truncated file
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({'inserted': sorted(inserted)}))
+    os.replace(tmp_path, path)
+
+
+def run(
+    from_date: datetime,
+    to_date: Optional[datetime] = None,
+    n_jobs: int = 1,
+    batch_hours: int = 24,
+    insert_hours: int = 24 * 7,
+    wait_for_job: bool = False,
+):
+    """
+    Predicts the rides of every hour from `from_date` to `to_date`, by
+    default the current hour, both included, and inserts them into the
+    predictions feature group.
+
+    The time-series of the whole range is read from the feature store once,
+    with `feature_store_api.read_time_range`. The features of `batch_hours` hours at a time are cut from it and
+    predicted in `n_jobs` worker processes, and the predictions are inserted
+    `insert_hours` hours at a time.
+    """
+    import config as config
+
+    timer = StageTimer('backfill predictions')
+
+    if to_date is None:
+        to_date = datetime.utcnow()
+    from_date = pd.to_datetime(from_date).floor('H')
+    to_date = pd.to_datetime(to_date).floor('H')
+    pickup_hours = pd.date_range(from_date, to_date, freq='H')
+    print(f'{from_date=} {to_date=}, {len(pickup_hours)} hours')
+
+    BACKFILL_DIR.mkdir(parents=True, exist_ok=True)
+    run_name = f'{from_date:%Y%m%dT%H}_{to_date:%Y%m%dT%H}'
+    checkpoint_path = BACKFILL_DIR / f'checkpoint_{run_name}.json'
+    inserted = _load_checkpoint(checkpoint_path)
+
+    # chunks of at most `insert_hours` consecutive hours not inserted yet,
+    # as (first hour, number of hours)
+    chunks = []
+    for hour in range(len(pickup_hours)):
+        if pickup_hours[hour].isoformat() in inserted:
+            continue
+        if chunks and sum(chunks[-1]) == hour and chunks[-1][1] < insert_hours:
+            chunks[-1] = (chunks[-1][0], chunks[-1][1] + 1)
+        else:
+            chunks.append((hour, 1))
+    if not chunks:
+        print(f'All hours already inserted, see {checkpoint_path}')
+        return
+    print(f'{len(chunks)} chunks to insert, checkpoint in {checkpoint_path}')
+
+    with timer.stage('load time-series data'):
+        from feature_store_api import read_time_range
+        ts_data = read_time_range(
+            config.FEATURE_GROUP_METADATA,
+            from_date - timedelta(hours=config.N_FEATURES),
+            to_date - timedelta(hours=1)
+        )
+
+    with timer.stage('cut inference windows'):
+        rides, location_ids = get_ts_array(ts_data, from_date, to_date, config.N_FEATURES)
+        del ts_data
+        rides_path = BACKFILL_DIR / f'rides_{run_name}.npy'
+        np.save(rides_path, rides)
+    print(f'{len(location_ids)} locations')
+
+    with timer.stage('load model'):
+        from inference import load_model_from_registry
+        from model import ServingModel
+        model = load_model_from_registry()
+        if not isinstance(model, ServingModel):
+            # checked against the pipeline on the first hour
+            first_hour = chunks[0][0]
+            validation_features = pd.DataFrame(
+                get_lags(rides, first_hour, 1, config.N_FEATURES),
+                columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(config.N_FEATURES))]
+            )
+            validation_features['pickup_hour'] = pickup_hours[first_hour]
+            validation_features['pickup_location_id'] = location_ids
+            model = ServingModel.from_pipeline(model, validation_features=validation_features)
+
+    # batches of `batch_hours` hours, which never span 2 chunks
+    batches: List[Tuple[int, int]] = [
+        (first, min(batch_hours, chunk_first + chunk_n_hours - first))
+        for chunk_first, chunk_n_hours in chunks
+        for first in range(chunk_first, chunk_first + chunk_n_hours, batch_hours)
+    ]
+    batch_args = (
+        [first for first, _ in batches],
+        [n_hours for _, n_hours in batches],
+        [location_ids] * len(batches),
+        [pickup_hours[first:first + n_hours] for first, n_hours in batches],
+    )
+
+    from feature_store_api import upsert_features
+
+    def _insert_chunks(batch_predictions: Iterator[np.ndarray]):
+        """Inserts every chunk as soon as all its batches are predicted"""
+        for chunk_first, chunk_n_hours in chunks:
+            with timer.stage('predict'):
+                n_batches = len(range(0, chunk_n_hours, batch_hours))
+                predictions = np.concatenate(list(islice(batch_predictions, n_batches)))
+
+            results = pd.DataFrame()
+            results['pickup_location_id'] = np.tile(location_ids, chunk_n_hours)
+            results['predicted_demand'] = predictions.round(0)
+            results['pickup_hour'] = pickup_hours[
+                chunk_first:chunk_first + chunk_n_hours].repeat(len(location_ids))
+
+            with timer.stage('insert into feature group'):
+                upsert_features(config.FEATURE_GROUP_PREDICTIONS_METADATA, results,
+                                wait_for_job=wait_for_job)
+            inserted.update(
+                hour.isoformat() for hour in pickup_hours[chunk_first:chunk_first + chunk_n_hours])
+            _save_checkpoint(checkpoint_path, inserted)
+            print(f'Inserted {len(results)} predictions from {pickup_hours[chunk_first]}')
+
+    if n_jobs == 1:
+        _init_worker(model, rides_path)
+        _insert_chunks(map(_predict_hours, *batch_args))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(model, rides_path)) as executor:
+            _insert_chunks(executor.map(_predict_hours, *batch_args))
+
+    rides_path.unlink()
+    timer.report()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--from-date', type=datetime.fromisoformat, required=True,
+                        help='first UTC hour to predict')
+    parser.add_argument('--to-date', type=datetime.fromisoformat, default=None,
+                        help='last UTC hour to predict, by default the current one')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='number of processes computing the predictions')
+    parser.add_argument('--batch-hours', type=int, default=24,
+                        help='number of hours predicted at a time by each process')
+    parser.add_argument('--insert-hours', type=int, default=24 * 7,
+                        help='number of hours of predictions in each insert')
+    parser.add_argument('--wait-for-job', action='store_true',
+                        help='wait for the Hopsworks materialization jobs to finish')
+    args = parser.parse_args()
+
+    run(from_date=args.from_date, to_date=args.to_date, n_jobs=args.n_jobs,
+        batch_hours=args.batch_hours, insert_hours=args.insert_hours,
+        wait_for_job=args.wait_for_job)
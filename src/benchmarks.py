@@ -0,0 +1,560 @@
+"""
+Micro-benchmarks for the data and inference pipelines.
+
+Run them from the `src` directory, e.g.
+
+    python benchmarks.py add_missing_slots --n_months=1,6,24
+    python benchmarks.py importtime
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import fire
+
+N_LOCATIONS = 265
+
+
+def _time_it(fn: Callable, *args, repeat: int = 3, **kwargs) -> float:
+    """Returns the best wall-clock time in seconds of `repeat` calls to `fn`"""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn(*args, **kwargs)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def _generate_agg_rides(
+    n_months: int,
+    n_locations: int = N_LOCATIONS,
+    fill_rate: float = 0.6,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Random hourly ride counts with a fraction `fill_rate` of the
+    (pickup_hour, pickup_location_id) slots present, like the output of the
+    groupby in `data.transform_raw_data_into_ts_data`
+    """
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range('2022-01-01', periods=n_months * 30 * 24, freq='H')
+    slots = pd.MultiIndex.from_product(
+        [hours, range(1, n_locations + 1)],
+        names=['pickup_hour', 'pickup_location_id']
+    ).to_frame(index=False)
+    agg_rides = slots[rng.random(len(slots)) < fill_rate].reset_index(drop=True)
+    agg_rides['rides'] = rng.integers(1, 100, size=len(agg_rides))
+    return agg_rides
+
+
+def _add_missing_slots_loop(ts_data: pd.DataFrame) -> pd.DataFrame:
+    """Previous per-location implementation of `data.add_missing_slots`"""
+    location_ids = range(1, ts_data['pickup_location_id'].max() + 1)
+    full_range = pd.date_range(ts_data['pickup_hour'].min(),
+                               ts_data['pickup_hour'].max(),
+                               freq='H')
+    output = pd.DataFrame()
+    for location_id in location_ids:
+        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, ['pickup_hour', 'rides']]
+        if ts_data_i.empty:
+            ts_data_i = pd.DataFrame.from_dict([
+                {'pickup_hour': ts_data['pickup_hour'].max(), 'rides': 0}
+            ])
+        ts_data_i.set_index('pickup_hour', inplace=True)
+        ts_data_i.index = pd.DatetimeIndex(ts_data_i.index)
+        ts_data_i = ts_data_i.reindex(full_range, fill_value=0)
+        ts_data_i['pickup_location_id'] = location_id
+        output = pd.concat([output, ts_data_i])
+    return output.reset_index().rename(columns={'index': 'pickup_hour'})
+
+
+def _print_table(header: Tuple[str, ...], rows: List[Tuple]):
+    print(' | '.join(f'{h:>14}' for h in header))
+    for row in rows:
+        print(' | '.join(
+            f'{v:>14.3f}' if isinstance(v, float) else f'{v:>14}' for v in row
+        ))
+
+
+def add_missing_slots(
+    n_months: Tuple[int, ...] = (1, 3, 6, 12, 24, 36),
+    max_months_loop: int = 6,
+    repeat: int = 3,
+):
+    """
+    Scaling of `data.add_missing_slots` from one month to a multi-year
+    backfill. The previous per-location loop is timed too, up to
+    `max_months_loop` months, and both outputs are checked to be equal.
+    """
+    from data import add_missing_slots as add_missing_slots_grid
+
+    if isinstance(n_months, int):
+        n_months = (n_months,)
+
+    rows = []
+    for n in n_months:
+        agg_rides = _generate_agg_rides(n)
+        grid_time = _time_it(add_missing_slots_grid, agg_rides, repeat=repeat)
+
+        loop_time = float('nan')
+        if n <= max_months_loop:
+            loop_time = _time_it(_add_missing_slots_loop, agg_rides, repeat=1)
+            pd.testing.assert_frame_equal(
+                add_missing_slots_grid(agg_rides),
+                _add_missing_slots_loop(agg_rides),
+            )
+        rows.append((n, len(agg_rides), grid_time, loop_time, loop_time / grid_time))
+
+    _print_table(('months', 'input rows', 'grid [s]', 'loop [s]', 'speedup'), rows)
+
+
+def _load_batch_of_features_loop(
+    ts_data: pd.DataFrame,
+    current_date: pd.Timestamp,
+    n_features: int,
+) -> pd.DataFrame:
+    """Previous per-location loop of `inference.load_batch_of_features_from_store`"""
+    location_ids = ts_data['pickup_location_id'].unique()
+    assert len(ts_data) == n_features * len(location_ids), "Time-series data is not complete."
+    ts_data = ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'])
+
+    x = np.ndarray(shape=(len(location_ids), n_features), dtype=np.float32)
+    for i, location_id in enumerate(location_ids):
+        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, :]
+        ts_data_i = ts_data_i.sort_values(by=['pickup_hour'])
+        x[i, :] = ts_data_i['rides'].values
+
+    features = pd.DataFrame(
+        x,
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(n_features))]
+    )
+    features['pickup_hour'] = current_date
+    features['pickup_location_id'] = location_ids
+    features.sort_values(by=['pickup_location_id'], inplace=True)
+    return features
+
+
+def inference_features(
+    n_locations: Tuple[int, ...] = (1, 10, 100, N_LOCATIONS),
+    n_features: int = 24 * 28,
+    repeat: int = 3,
+):
+    """
+    `inference.transform_ts_data_into_features` against the previous
+    per-location loop, on shuffled time-series of `n_features` hours
+    """
+    from inference import transform_ts_data_into_features
+
+    if isinstance(n_locations, int):
+        n_locations = (n_locations,)
+
+    current_date = pd.Timestamp('2024-03-01 12:00')
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for n in n_locations:
+        hours = pd.date_range(end=current_date - pd.Timedelta(hours=1), periods=n_features, freq='H')
+        ts_data = pd.MultiIndex.from_product(
+            [hours, range(1, n + 1)], names=['pickup_hour', 'pickup_location_id']
+        ).to_frame(index=False).sample(frac=1, random_state=0)
+        ts_data['rides'] = rng.integers(0, 100, size=len(ts_data))
+
+        new_time = _time_it(transform_ts_data_into_features, ts_data, current_date,
+                            n_features, repeat=repeat)
+        loop_time = _time_it(_load_batch_of_features_loop, ts_data, current_date,
+                             n_features, repeat=repeat)
+        pd.testing.assert_frame_equal(
+            transform_ts_data_into_features(ts_data, current_date, n_features),
+            _load_batch_of_features_loop(ts_data, current_date, n_features).reset_index(drop=True),
+        )
+        rows.append((n, len(ts_data), new_time, loop_time, loop_time / new_time))
+
+    _print_table(('locations', 'input rows', 'reshape [s]', 'loop [s]', 'speedup'), rows)
+
+
+def serving_model(
+    n_locations: Tuple[int, ...] = (1, N_LOCATIONS),
+    n_estimators: int = 100,
+    repeat: int = 20,
+):
+    """
+    Prediction latency of `model.ServingModel` against the `get_pipeline`
+    pipeline it is exported from, for batches of `n_locations` rows with
+    28 days of hourly lags. Predictions are checked to be bit-identical.
+    """
+    from data import add_missing_slots, transform_ts_data_into_features_and_target
+    from model import get_pipeline, ServingModel
+
+    if isinstance(n_locations, int):
+        n_locations = (n_locations,)
+
+    # a synthetic model, trained on 2 months of random rides
+    ts_data = add_missing_slots(_generate_agg_rides(2, n_locations=20))
+    features, target = transform_ts_data_into_features_and_target(
+        ts_data, input_seq_len=24 * 28, step_size=1)
+    pipeline = get_pipeline(n_estimators=n_estimators, verbose=-1)
+    pipeline.fit(features.copy(), target)
+    serving = ServingModel.from_pipeline(pipeline, validation_features=features.copy())
+
+    rows = []
+    for n in n_locations:
+        batch = features.iloc[:n].reset_index(drop=True)
+        lags = batch[serving.lag_columns].to_numpy()
+        pickup_location_id = batch['pickup_location_id'].to_numpy()
+        pickup_hour = batch['pickup_hour']
+
+        pipeline_time = _time_it(pipeline.predict, batch, repeat=repeat)
+        serving_time = _time_it(serving.predict, batch, repeat=repeat)
+        array_time = _time_it(serving.predict_array, lags, pickup_location_id, pickup_hour,
+                              repeat=repeat)
+        assert np.array_equal(pipeline.predict(batch), serving.predict(batch))
+        rows.append((n, 1e3 * pipeline_time, 1e3 * serving_time, 1e3 * array_time,
+                     pipeline_time / serving_time))
+
+    _print_table(('locations', 'pipeline [ms]', 'serving [ms]', 'array [ms]', 'speedup'), rows)
+
+
+def _predict_next_hours_loop(pipeline, features: pd.DataFrame, n_hours: int) -> np.ndarray:
+    """Recursive rollout rebuilding the feature frame and calling the pipeline every hour"""
+    lag_columns = [c for c in features.columns if c.startswith('rides_previous_')]
+    predictions = []
+    for hour in range(n_hours):
+        predictions.append(pipeline.predict(features))
+        features = features.copy()
+        features[lag_columns] = np.column_stack([
+            features[lag_columns[1:]].to_numpy(),
+            np.maximum(predictions[-1], 0).astype(features[lag_columns[0]].dtype),
+        ])
+        features['pickup_hour'] = features['pickup_hour'] + pd.Timedelta(hours=1)
+    return np.column_stack(predictions)
+
+
+def multi_horizon(
+    n_hours: Tuple[int, ...] = (1, 6, 24),
+    n_estimators: int = 100,
+    repeat: int = 3,
+):
+    """
+    `inference.get_model_predictions_for_next_hours` for all locations against
+    a rollout that rebuilds the feature frame and calls the pipeline every
+    hour. Predictions are checked to be equal.
+    """
+    from data import add_missing_slots, transform_ts_data_into_features_and_target
+    from model import get_pipeline, ServingModel
+    from inference import get_model_predictions_for_next_hours
+
+    if isinstance(n_hours, int):
+        n_hours = (n_hours,)
+
+    ts_data = add_missing_slots(_generate_agg_rides(2, n_locations=N_LOCATIONS))
+    features, target = transform_ts_data_into_features_and_target(
+        ts_data, input_seq_len=24 * 28, step_size=24 * 7)
+    pipeline = get_pipeline(n_estimators=n_estimators, verbose=-1)
+    pipeline.fit(features, target)
+    serving = ServingModel.from_pipeline(pipeline)
+
+    # one window per location, like the inference features
+    batch = features.groupby('pickup_location_id').head(1).reset_index(drop=True)
+
+    rows = []
+    for n in n_hours:
+        rollout_time = _time_it(get_model_predictions_for_next_hours, serving, batch, n,
+                                repeat=repeat)
+        loop_time = _time_it(_predict_next_hours_loop, pipeline, batch, n, repeat=repeat)
+
+        predictions = get_model_predictions_for_next_hours(serving, batch, n)
+        expected = _predict_next_hours_loop(pipeline, batch, n)
+        assert np.array_equal(predictions['predicted_demand'].to_numpy(),
+                              expected.T.ravel().round(0))
+        rows.append((n, len(predictions), rollout_time, loop_time, loop_time / rollout_time))
+
+    _print_table(('hours', 'predictions', 'rollout [s]', 'loop [s]', 'speedup'), rows)
+
+
+def _backfill_loop(pipeline, ts_data: pd.DataFrame, pickup_hours: pd.DatetimeIndex) -> np.ndarray:
+    """Features and predictions of every hour one at a time, like the hourly inference pipeline"""
+    from inference import transform_ts_data_into_features, get_model_predictions
+
+    predictions = []
+    for pickup_hour in pickup_hours:
+        features = transform_ts_data_into_features(ts_data, pickup_hour)
+        predictions.append(get_model_predictions(pipeline, features)['predicted_demand'].to_numpy())
+    return np.concatenate(predictions)
+
+
+def backfill(
+    n_days: Tuple[int, ...] = (1, 7),
+    n_estimators: int = 100,
+    batch_hours: int = 24,
+):
+    """
+    Predictions of every hour for all locations cut from a single time-series
+    array by `backfill_predictions`, against building the features and
+    predicting hour after hour. Predictions are checked to be equal.
+    """
+    import backfill_predictions
+    from data import add_missing_slots, transform_ts_data_into_features_and_target
+    from model import get_pipeline, ServingModel
+
+    if isinstance(n_days, int):
+        n_days = (n_days,)
+
+    ts_data = add_missing_slots(_generate_agg_rides(2, n_locations=N_LOCATIONS))
+    features, target = transform_ts_data_into_features_and_target(
+        ts_data, input_seq_len=24 * 28, step_size=24 * 7)
+    pipeline = get_pipeline(n_estimators=n_estimators, verbose=-1)
+    pipeline.fit(features, target)
+    serving = ServingModel.from_pipeline(pipeline)
+    from_date = ts_data['pickup_hour'].min() + pd.Timedelta(days=28)
+
+    def _backfill(pickup_hours: pd.DatetimeIndex) -> np.ndarray:
+        rides, location_ids = backfill_predictions.get_ts_array(
+            ts_data, pickup_hours[0], pickup_hours[-1], 24 * 28)
+        backfill_predictions._worker_model = serving
+        backfill_predictions._worker_rides = rides
+        return np.concatenate([
+            backfill_predictions._predict_hours(
+                first, min(batch_hours, len(pickup_hours) - first), location_ids,
+                pickup_hours[first:first + batch_hours])
+            for first in range(0, len(pickup_hours), batch_hours)
+        ]).round(0)
+
+    rows = []
+    for n in n_days:
+        pickup_hours = pd.date_range(from_date, periods=24 * n, freq='H')
+        backfill_time = _time_it(_backfill, pickup_hours, repeat=1)
+        loop_time = _time_it(_backfill_loop, pipeline, ts_data, pickup_hours, repeat=1)
+        assert np.array_equal(_backfill(pickup_hours),
+                              _backfill_loop(pipeline, ts_data, pickup_hours))
+        rows.append((n, len(pickup_hours) * N_LOCATIONS, backfill_time, loop_time,
+                     loop_time / backfill_time))
+
+    _print_table(('days', 'predictions', 'backfill [s]', 'loop [s]', 'speedup'), rows)
+
+
+def _monitoring_metrics_loop(monitoring_df: pd.DataFrame, n_top_locations: int = 10):
+    """MAE per hour, and per hour of the top locations, as the monitoring dashboard computed them"""
+    from sklearn.metrics import mean_absolute_error
+
+    def _mae_per_hour(df: pd.DataFrame) -> pd.Series:
+        return df.groupby('pickup_hour') \
+            .apply(lambda g: mean_absolute_error(g['rides'], g['predicted_demand']))
+
+    top_locations = monitoring_df.groupby('pickup_location_id')['rides'].sum() \
+        .nlargest(n_top_locations).index
+    return _mae_per_hour(monitoring_df), {
+        location_id: _mae_per_hour(monitoring_df[monitoring_df.pickup_location_id == location_id])
+        for location_id in top_locations
+    }
+
+
+def monitoring_metrics(
+    n_days: Tuple[int, ...] = (30, 90),
+    n_locations: int = N_LOCATIONS,
+    repeat: int = 3,
+):
+    """
+    `metrics.compute_metrics`, all metrics of all groups, against the MAE
+    per hour and per hour of the top 10 locations with `groupby.apply` and
+    sklearn. The MAEs are checked to be equal.
+    """
+    from metrics import compute_metrics
+
+    if isinstance(n_days, int):
+        n_days = (n_days,)
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for n in n_days:
+        # every (hour, location) of `n` days, from whole months of 30 days
+        monitoring_df = _generate_agg_rides(-(-n // 30), n_locations=n_locations, fill_rate=1.0)
+        monitoring_df = monitoring_df[monitoring_df['pickup_hour'] <
+                                      monitoring_df['pickup_hour'].min() + pd.Timedelta(days=n)]
+        monitoring_df['predicted_demand'] = rng.integers(0, 100, size=len(monitoring_df)).astype(float)
+
+        metrics_time = _time_it(compute_metrics, monitoring_df, repeat=repeat)
+        loop_time = _time_it(_monitoring_metrics_loop, monitoring_df, repeat=1)
+
+        metrics = compute_metrics(monitoring_df)
+        mae_per_hour, mae_per_top_location = _monitoring_metrics_loop(monitoring_df)
+        assert np.allclose(metrics['hour']['mae'].to_numpy(), mae_per_hour.to_numpy())
+        for location_id, mae in mae_per_top_location.items():
+            assert np.allclose(
+                metrics['hour_location'].xs(location_id, level='pickup_location_id')['mae'],
+                mae.to_numpy())
+        rows.append((n, len(monitoring_df), metrics_time, loop_time, loop_time / metrics_time))
+
+    _print_table(('days', 'rows', 'metrics [s]', 'loop [s]', 'speedup'), rows)
+
+
+def _read_shapefile(shapefile: Path):
+    """Taxi zones as the frontends read them before `geometry`, without the download"""
+    import geopandas as gpd
+    return gpd.read_file(shapefile).to_crs('epsg:4326')
+
+
+def taxi_zones(
+    tolerance: Optional[float] = None,
+    repeat: int = 3,
+):
+    """
+    `geometry.load_taxi_zones`, from the simplified GeoParquet file, against
+    reading and reprojecting the shapefile, with the size of the GeoJSON of
+    each, as sent to the map in the browser
+    """
+    import geopandas as gpd
+    from geometry import SIMPLIFY_TOLERANCE, TAXI_ZONES_SHAPEFILE, build_taxi_zones
+
+    if tolerance is None:
+        tolerance = SIMPLIFY_TOLERANCE
+    path = build_taxi_zones(tolerance)
+
+    shapefile_time = _time_it(_read_shapefile, TAXI_ZONES_SHAPEFILE, repeat=repeat)
+    parquet_time = _time_it(gpd.read_parquet, path, repeat=repeat)
+    shapefile_mb = len(_read_shapefile(TAXI_ZONES_SHAPEFILE).to_json()) / 1e6
+    parquet_mb = len(gpd.read_parquet(path).to_json()) / 1e6
+
+    _print_table(('source', 'load [s]', 'GeoJSON [MB]'), [
+        ('shapefile', shapefile_time, shapefile_mb),
+        ('geoparquet', parquet_time, parquet_mb),
+    ])
+
+
+def _pseudocolor_apply(values: pd.Series) -> pd.Series:
+    """Fill colors as the frontends computed them, one tuple per row"""
+    min_value, max_value = values.min(), values.max()
+    return values.apply(lambda x: tuple(
+        (x - min_value) / (max_value - min_value) * (b - a) + a
+        for a, b in zip((0, 0, 0), (0, 255, 0))))
+
+
+def _map_payload_loop(zones, predictions: pd.DataFrame) -> str:
+    """GeoJSON of the map as the frontends sent it, with every zone attribute"""
+    import json
+    df = pd.merge(zones, predictions, right_on='pickup_location_id', left_on='LocationID')
+    df['fill_color'] = _pseudocolor_apply(df['predicted_demand'])
+    return json.dumps(df.__geo_interface__)
+
+
+def _map_payload(zones, predictions: pd.DataFrame) -> str:
+    import json
+    from plot import get_map_data
+    return json.dumps(get_map_data(zones, predictions))
+
+
+def map_payload(
+    n_values: int = 1_000_000,
+    repeat: int = 3,
+):
+    """
+    `plot.get_fill_colors` on `n_values` values against `Series.apply`, and
+    the time and size of the GeoJSON of the map of the predictions of every
+    zone with `plot.get_map_data` against the full merged frame
+    """
+    from geometry import TAXI_ZONES_SHAPEFILE
+    from plot import get_fill_colors
+
+    rng = np.random.default_rng(0)
+    values = pd.Series(rng.integers(0, 100, size=n_values).astype(float))
+    colors_time = _time_it(get_fill_colors, values.to_numpy(), repeat=repeat)
+    apply_time = _time_it(_pseudocolor_apply, values, repeat=1)
+    assert np.abs(get_fill_colors(values.to_numpy())[:, :3]
+                  - np.array(_pseudocolor_apply(values).tolist())).max() <= 0.5
+
+    zones = _read_shapefile(TAXI_ZONES_SHAPEFILE)
+    predictions = pd.DataFrame({
+        'pickup_location_id': zones['LocationID'].unique(),
+        'predicted_demand': rng.integers(0, 100, size=zones['LocationID'].nunique()).astype(float),
+    })
+    payload_time = _time_it(_map_payload, zones, predictions, repeat=repeat)
+    loop_payload_time = _time_it(_map_payload_loop, zones, predictions, repeat=repeat)
+
+    _print_table(('step', 'new [s]', 'old [s]', 'speedup'), [
+        ('fill colors', colors_time, apply_time, apply_time / colors_time),
+        ('GeoJSON', payload_time, loop_payload_time, loop_payload_time / payload_time),
+    ])
+    print(f'GeoJSON size: {len(_map_payload(zones, predictions)) / 1e6:.2f} MB, '
+          f'before {len(_map_payload_loop(zones, predictions)) / 1e6:.2f} MB')
+
+
+# import time budgets, in seconds, of the modules the apps and pipelines
+# start from. pandas alone takes about 0.5s.
+IMPORT_TIME_BUDGETS = {
+    'paths': 0.1,
+    'config': 0.1,
+    'feature_store_api': 0.1,
+    'data': 1.0,
+    'model': 1.0,
+    'inference': 1.0,
+    'plot': 1.0,
+    'geometry': 0.1,
+}
+
+# packages that must only be imported by the functions that use them
+LAZY_IMPORTS = ('hsfs', 'hopsworks', 'lightgbm', 'sklearn', 'requests', 'dotenv',
+                'plotly', 'geopandas', 'pydeck')
+
+
+def _import_time(module: str) -> Tuple[float, List[str]]:
+    """
+    Cumulative import time in seconds of `module` in a fresh interpreter,
+    from `python -X importtime`, and the modules it imported. It runs
+    without HOPSWORKS_API_KEY, like tests and offline runs.
+    """
+    env = {k: v for k, v in os.environ.items() if k != 'HOPSWORKS_API_KEY'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=Path(__file__).parent, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f'import {module} failed:\n{result.stderr[-2000:]}')
+
+    # lines look like `import time:  self [us] | cumulative | imported package`
+    imported = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('imported package'):
+            _, cumulative, name = line.split('|')
+            imported[name.strip()] = int(cumulative) / 1e6
+    return imported[module], list(imported)
+
+
+def importtime(
+    modules: Tuple[str, ...] = tuple(IMPORT_TIME_BUDGETS),
+    repeat: int = 3,
+):
+    """
+    Import time of the `src` modules, as a regression check: it fails if a
+    module takes longer than its IMPORT_TIME_BUDGETS, or imports any of the
+    LAZY_IMPORTS at module level.
+    """
+    if isinstance(modules, str):
+        modules = (modules,)
+
+    rows, errors = [], []
+    for module in modules:
+        timings, imported = [], []
+        for _ in range(repeat):
+            seconds, imported = _import_time(module)
+            timings.append(seconds)
+        seconds = min(timings)
+        budget = IMPORT_TIME_BUDGETS.get(module, float('nan'))
+
+        lazy = sorted({name.split('.')[0] for name in imported} & set(LAZY_IMPORTS))
+        if lazy:
+            errors.append(f'import {module} imports {lazy}')
+        if seconds > budget:
+            errors.append(f'import {module} takes {seconds:.3f}s, over its {budget}s budget')
+        rows.append((module, seconds, budget, ', '.join(lazy) or '-'))
+
+    _print_table(('module', 'import [s]', 'budget [s]', 'eager imports'), rows)
+
+    if errors:
+        raise Exception('\n'.join(errors))
+
+
+if __name__ == '__main__':
+    fire.Fire()
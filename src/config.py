@@ -1,16 +1,53 @@
 import os 
-from dotenv import load_dotenv
+from typing import Optional
 
 from paths import PARENT_DIR
 from feature_store_api import FeatureGroupConfig, FeatureViewConfig
 
-load_dotenv(PARENT_DIR / '.env')
+class Settings:
+    """
+    Secrets and switches read from the environment the first time they are used, after
+    loading the `.env` file on the project root, so importing `config` works
+    offline and without credentials.
+    """
+    def __init__(self, env_file=PARENT_DIR / '.env'):
+        self.env_file = env_file
+        self._env_loaded = False
+
+    def _getenv(self, name: str) -> Optional[str]:
+        if not self._env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv(self.env_file)
+            self._env_loaded = True
+        return os.environ.get(name)
+
+    @property
+    def hopsworks_api_key(self) -> str:
+        api_key = self._getenv('HOPSWORKS_API_KEY')
+        if api_key is None:
+            raise Exception('Create an .env file on the project root with the api key')
+        return api_key
+
+    @property
+    def feature_store_backend(self) -> str:
+        """`hopsworks`, the default, or `local` for `local_feature_store`"""
+        backend = self._getenv('FEATURE_STORE_BACKEND') or 'hopsworks'
+        if backend not in ('hopsworks', 'local'):
+            raise Exception(f'Unknown FEATURE_STORE_BACKEND {backend}, use hopsworks or local')
+        return backend
+
+settings = Settings()
+
+def __getattr__(name: str):
+    # `config.HOPSWORKS_API_KEY` is only read when it is used
+    if name == 'HOPSWORKS_API_KEY':
+        return settings.hopsworks_api_key
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 HOPSWORKS_PROJECT_NAME = 'dpetrik2'
-try:
-    HOPSWORKS_API_KEY = os.environ['HOPSWORKS_API_KEY']
-except:
-    raise Exception('Create an .env file on the project root with the api key')
+
+# seconds before we log in to Hopsworks again and refresh all the handles
+HOPSWORKS_SESSION_TTL = 60 * 60
 
 FEATURE_GROUP_NAME = 'time_series_hourly_feature_group'
 FEATURE_GROUP_VERSION = 1
@@ -26,7 +63,18 @@ FEATURE_GROUP_PREDICTIONS_METADATA = FeatureGroupConfig(
     name='model_predictions_feature_group',
     version=1,
     description="Predictions generate by our production model",
-    primary_key = ['pickup_location_id', 'pickup_hour]'],
+    primary_key = ['pickup_location_id', 'pickup_hour'],
+    event_time='pickup_hour',
+)
+
+# predictions of the next hours, `horizon` hours after the last hour of their
+# features. Only the 1 hour ahead ones go to the predictions feature group,
+# the one monitoring and the frontends read.
+FEATURE_GROUP_FORECASTS_METADATA = FeatureGroupConfig(
+    name='model_forecasts_feature_group',
+    version=1,
+    description='Predictions of the next hours by our production model, per horizon',
+    primary_key=['pickup_location_id', 'pickup_hour', 'horizon'],
     event_time='pickup_hour',
 )
 
@@ -45,5 +93,32 @@ FEATURE_GROUP_METADATA = FeatureGroupConfig(
     online_enabled=True,
 )
 
+FEATURE_VIEW_METADATA = FeatureViewConfig(
+    name=FEATURE_VIEW_NAME,
+    version=FEATURE_VIEW_VERSION,
+    feature_group=FEATURE_GROUP_METADATA,
+)
+
+# error sums of the predictions of all locations per pickup_hour, with the
+# columns of `metrics.SUM_COLUMNS`, updated by the monitoring pipeline
+FEATURE_GROUP_MONITORING_METADATA = FeatureGroupConfig(
+    name='monitoring_rollup_feature_group',
+    version=2,
+    description='Hourly error sums of the predictions against the actual rides',
+    primary_key=['pickup_hour'],
+    event_time='pickup_hour',
+)
+
+# error sums of the predictions per (pickup_hour, pickup_location_id), with
+# the columns of `metrics.SUM_COLUMNS`, written with the hourly ones, for the
+# per-location charts of the dashboard
+FEATURE_GROUP_MONITORING_LOCATIONS_METADATA = FeatureGroupConfig(
+    name='monitoring_rollup_locations_feature_group',
+    version=1,
+    description='Hourly error sums of the predictions against the actual rides per location',
+    primary_key=['pickup_location_id', 'pickup_hour'],
+    event_time='pickup_hour',
+)
+
 MONITORING_FV_NAME = 'monitoring_feature_view'
 MONITORING_FV_VERSION = 1
\ No newline at end of file
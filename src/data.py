@@ -1,22 +1,132 @@
+import os
+import re
+import hashlib
 from pathlib import Path
 from datetime import datetime, timedelta
-import requests
-from typing import Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, List, Tuple, Iterator
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
-from paths import RAW_DATA_DIR
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from numpy.lib.stride_tricks import sliding_window_view
+from paths import RAW_DATA_DIR, TRANSFORMED_DATA_DIR
 
-def download_file_of_raw_data(year: int, month: int) -> Path:
-    url = f'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{year}-{month:02d}.parquet'
-    res = requests.get(url)
+RAW_DATA_URL = 'https://d37ci6vzurychx.cloudfront.net/trip-data'
 
-    if res.status_code == 200:
-        path = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
-        open(path, "wb").write(res.content)
-        return path
-    else:
-        raise Exception(f'{url} is not available.')
+def _check_downloaded_file(path: Path, expected_size: Optional[int], etag: Optional[str]):
+    """
+    Raises if the file at `path` does not have the size announced by the
+    server, does not match the ETag when it is a plain MD5 checksum, or is
+    not a complete parquet file.
+    """
+    size = path.stat().st_size
+    if expected_size is not None and size != expected_size:
+        raise Exception(f'{path.name} has {size} bytes, expected {expected_size}')
+
+    etag = (etag or '').strip('"')
+    if re.fullmatch(r'[0-9a-f]{32}', etag):
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                md5.update(chunk)
+        if md5.hexdigest() != etag:
+            raise Exception(f'{path.name} checksum does not match')
+
+    # parquet files start and end with these magic bytes
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        f.seek(max(size - 4, 0))
+        tail = f.read(4)
+    if head != b'PAR1' or tail != b'PAR1':
+        raise Exception(f'{path.name} is not a valid parquet file')
+
+def download_file_of_raw_data(
+    year: int,
+    month: int,
+    base_url: str = RAW_DATA_URL,
+    chunk_size: int = 1024*1024,
+    timeout: int = 60,
+) -> Path:
+    """
+    Downloads the rides of one month into RAW_DATA_DIR.
+
+    The file is streamed in chunks into a `.part` file, which is resumed with
+    an HTTP range request if a previous download was interrupted, checked
+    against the size and checksum announced by the server and only then
+    renamed to `rides_YYYY-MM.parquet`. So the final file is either complete
+    or missing, never corrupt.
+    """
+    import requests
+
+    url = f'{base_url}/yellow_tripdata_{year}-{month:02d}.parquet'
+    path = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
+    part_path = path.with_name(path.name + '.part')
+    RAW_DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+    n_bytes = part_path.stat().st_size if part_path.exists() else 0
+    headers = {'Range': f'bytes={n_bytes}-'} if n_bytes > 0 else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as res:
+
+        if res.status_code == 206:
+            # resume the interrupted download, e.g. `Content-Range: bytes 100-199/200`
+            mode = 'ab'
+            expected_size = int(res.headers['Content-Range'].split('/')[-1])
+        elif res.status_code == 200:
+            # the server sends the whole file
+            mode = 'wb'
+            expected_size = int(res.headers['Content-Length']) \
+                if 'Content-Length' in res.headers else None
+        elif res.status_code == 416:
+            # the `.part` file is not smaller than the remote file, start over
+            part_path.unlink()
+            return download_file_of_raw_data(year, month, base_url, chunk_size, timeout)
+        else:
+            raise Exception(f'{url} is not available.')
+
+        with open(part_path, mode) as f:
+            for chunk in res.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+        etag = res.headers.get('ETag')
+
+    try:
+        _check_downloaded_file(part_path, expected_size, etag)
+    except Exception:
+        part_path.unlink()
+        raise
+
+    # atomic on the same file system
+    os.replace(part_path, path)
+    return path
+
+def download_files_of_raw_data(
+    year_months: List[Tuple[int, int]],
+    max_workers: int = 4,
+    **kwargs
+) -> List[Path]:
+    """
+    Downloads several months in parallel with `download_file_of_raw_data`.
+    Returns the paths of the files that were downloaded, and prints the months
+    that are not available.
+    """
+    paths = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_file_of_raw_data, year, month, **kwargs): (year, month)
+            for year, month in year_months
+        }
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                paths.append(future.result())
+                print(f'Downloaded file {year}-{month:02d}')
+            except Exception as e:
+                print(f'{year}-{month:02d} file is not available: {e}')
+
+    return sorted(paths)
 
 # removes all the incorrect data from specific period
 # e.g removes all unwanted months from february
@@ -35,88 +145,133 @@ def validate_raw_data(
     rides = rides[rides.pickup_datetime.dt.year == year]
     return rides
 
-#loads raw data from storage or download it from website and then loading it into pandas dataframe
-def load_raw_data(
+# columns we read from the raw parquet files and their new names
+RAW_DATA_COLUMNS = {
+    'tpep_pickup_datetime': 'pickup_datetime',
+    'PULocationID': 'pickup_location_id',
+}
+# types differ slightly between monthly files, so we cast every batch to these
+RAW_DATA_SCHEMA = pa.schema([
+    ('tpep_pickup_datetime', pa.timestamp('us')),
+    ('PULocationID', pa.int64()),
+])
+
+def iter_raw_data_batches(
     year: int,
-    months: Optional[List[int]] = None
-) -> pd.DataFrame:
+    months: Optional[List[int]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Streams Arrow record batches of rides picked up in `year` (and, if given,
+    in [from_date, to_date)), downloading the monthly files that are missing.
 
-    rides = pd.DataFrame()
-    
+    Only `RAW_DATA_COLUMNS` are read, and the datetime range is pushed down to
+    the parquet reader so row groups outside of it are skipped.
+    """
     if months is None:
         months = list(range(1, 13))
     elif isinstance(months, int):
         months = [months]
 
+    # same rule as `validate_raw_data`, narrowed to the requested range
+    start = pd.Timestamp(year=year, month=1, day=1)
+    end = pd.Timestamp(year=year + 1, month=1, day=1)
+    if from_date is not None:
+        start = max(start, pd.Timestamp(from_date))
+    if to_date is not None:
+        end = min(end, pd.Timestamp(to_date))
+
+    pickup_datetime = ds.field('tpep_pickup_datetime')
+    in_range = (pickup_datetime >= pa.scalar(start.to_pydatetime(), pa.timestamp('us'))) & \
+        (pickup_datetime < pa.scalar(end.to_pydatetime(), pa.timestamp('us')))
+
     #if file is already here dont download it
+    missing_months = [
+        month for month in months
+        if not (RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet').exists()
+    ]
+    if missing_months:
+        print(f'Downloading files {", ".join(f"{year}-{m:02d}" for m in missing_months)}')
+        download_files_of_raw_data([(year, month) for month in missing_months])
+
     for month in months:
         local_file = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
         if not local_file.exists():
-            try:
-                print(f'Downloading file {year}-{month:02d}')
-                download_file_of_raw_data(year, month)
-            except:
-                print(f'{year}-{month:02d} file is not available')
-                continue
-        else:
-            print(f'File {year}-{month:02d} was already in local storage') 
-
-        # load the file into Pandas
-        rides_one_month = pd.read_parquet(local_file)
-        
-
-        # rename columns and take only the ones we need
-        rides_one_month = rides_one_month[['tpep_pickup_datetime', 'PULocationID']]
-        rides_one_month.rename(columns={
-            'tpep_pickup_datetime': 'pickup_datetime',
-            'PULocationID': 'pickup_location_id',
-        }, inplace=True)
-        
+            continue
+        elif month not in missing_months:
+            print(f'File {year}-{month:02d} was already in local storage')
+
+        dataset = ds.dataset(local_file, format='parquet')
+        for batch in dataset.to_batches(columns=list(RAW_DATA_COLUMNS), filter=in_range):
+            if batch.num_rows > 0:
+                yield pa.RecordBatch.from_arrays(
+                    [column.cast(field.type, safe=False)
+                     for column, field in zip(batch.columns, RAW_DATA_SCHEMA)],
+                    schema=RAW_DATA_SCHEMA,
+                )
 
-        # validate the file
-        rides_one_month = validate_raw_data(rides_one_month, year, month)
+#loads raw data from storage or download it from website and then loading it into pandas dataframe
+def load_raw_data(
+    year: int,
+    months: Optional[List[int]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Loads the rides picked up in `year`, optionally only the given `months`
+    and the ones in [from_date, to_date), with columns
+    - pickup_datetime
+    - pickup_location_id
+    """
+    batches = iter_raw_data_batches(year, months, from_date, to_date)
 
-        # append to existing data
-        
-        rides = pd.concat([rides, rides_one_month], ignore_index=True)
-        # rides = rides.append(rides_one_month removed in pandas 2.0
-    
-    rides = rides[['pickup_datetime', 'pickup_location_id']]
+    # concatenate all batches once and rename columns
+    rides = pa.Table.from_batches(batches, schema=RAW_DATA_SCHEMA) \
+        .rename_columns(list(RAW_DATA_COLUMNS.values())) \
+        .to_pandas()
 
     return rides
 
 #add rows that have no rides
-def add_missing_slots(ts_data: pd.DataFrame) -> pd.DataFrame:
-    location_ids = range(1, ts_data['pickup_location_id'].max() + 1)
+def add_missing_slots(
+    ts_data: pd.DataFrame,
+    location_ids: Optional[List[int]] = None,
+    from_hour: Optional[datetime] = None,
+    to_hour: Optional[datetime] = None,
+) -> pd.DataFrame:
+    """
+    Adds a row with 0 rides for every (pickup_location_id, pickup_hour) slot
+    missing in `ts_data`, for all location ids from 1 to the max one and all
+    hours between the first and the last one. Pass `location_ids`, `from_hour`
+    or `to_hour` to use a different grid, rows outside of it are dropped.
+
+    The full grid is built with a single reindex on a
+    (pickup_location_id, pickup_hour) MultiIndex, so the cost grows linearly
+    with the number of slots instead of one filter + concat per location.
+    """
+    if location_ids is None:
+        location_ids = range(1, ts_data['pickup_location_id'].max() + 1)
 
-    full_range = pd.date_range(ts_data['pickup_hour'].min(),
-                               ts_data['pickup_hour'].max(),
+    full_range = pd.date_range(ts_data['pickup_hour'].min() if from_hour is None else from_hour,
+                               ts_data['pickup_hour'].max() if to_hour is None else to_hour,
                                freq='H')
-    output = pd.DataFrame()
-    for location_id in tqdm(location_ids):
 
-        # keep only rides for this 'location_id'
-        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, ['pickup_hour', 'rides']]
-        
-        if ts_data_i.empty:
-            # add a dummy entry with a 0
-            ts_data_i = pd.DataFrame.from_dict([
-                {'pickup_hour': ts_data['pickup_hour'].max(), 'rides': 0}
-            ])
-
-        ts_data_i.set_index('pickup_hour', inplace=True)
-        ts_data_i.index = pd.DatetimeIndex(ts_data_i.index)
-        ts_data_i = ts_data_i.reindex(full_range, fill_value=0)
-        
-        # add back `location_id` columns
-        ts_data_i['pickup_location_id'] = location_id
+    # cartesian product of locations and hours, sorted by location and time
+    full_index = pd.MultiIndex.from_product(
+        [location_ids, full_range],
+        names=['pickup_location_id', 'pickup_hour']
+    )
+
+    output = (
+        ts_data
+        .set_index(['pickup_location_id', 'pickup_hour'])['rides']
+        .reindex(full_index, fill_value=0)
+        .reset_index()
+    )
 
-        output = pd.concat([output, ts_data_i])
-    
-    # move the pickup_hour from the index to a dataframe column
-    output = output.reset_index().rename(columns={'index': 'pickup_hour'})
-    
-    return output
+    # same column order as the time-series data we store
+    return output[['pickup_hour', 'rides', 'pickup_location_id']]
 
 
 def transform_raw_data_into_ts_data(
@@ -130,68 +285,299 @@ def transform_raw_data_into_ts_data(
 
     return agg_rides_all_slots
 
-def transform_ts_data_into_features_and_target(
-    ts_data: pd.DataFrame,
-    input_seq_len: int,
-    step_size: int
+# hourly counts per location kept between runs of the feature pipeline
+HOURLY_AGGREGATE_PATH = TRANSFORMED_DATA_DIR / 'ts_data_hourly_aggregate.parquet'
+
+def load_hourly_aggregate(
+    path: Path = HOURLY_AGGREGATE_PATH
+) -> Tuple[pd.DataFrame, Optional[pd.Timestamp]]:
+    """
+    Returns the persisted hourly counts and the watermark, i.e. the pickup
+    datetime of the newest ride aggregated so far. (empty, None) if there is
+    no aggregate yet.
+    """
+    if not path.exists():
+        empty = pd.DataFrame({
+            'pickup_hour': pd.Series(dtype='datetime64[ns]'),
+            'rides': pd.Series(dtype='int64'),
+            'pickup_location_id': pd.Series(dtype='int64'),
+        })
+        return empty, None
+
+    table = pq.read_table(path)
+    watermark = pd.Timestamp(table.schema.metadata[b'watermark'].decode())
+    return table.to_pandas(), watermark
+
+def get_incremental_fetch_start(
+    late_arrival_lookback: timedelta = timedelta(hours=3),
+    path: Path = HOURLY_AGGREGATE_PATH
+) -> Optional[pd.Timestamp]:
+    """
+    Pickup datetime from which `update_hourly_aggregate` needs raw rides: the
+    start of the hour `late_arrival_lookback` before the watermark. None if
+    there is no aggregate yet and all rides are needed.
+    """
+    _, watermark = load_hourly_aggregate(path)
+    if watermark is None:
+        return None
+    return (watermark - late_arrival_lookback).floor('H')
+
+def update_hourly_aggregate(
+    rides: pd.DataFrame,
+    late_arrival_lookback: timedelta = timedelta(hours=3),
+    retention: timedelta = timedelta(days=28),
+    path: Path = HOURLY_AGGREGATE_PATH
 ) -> pd.DataFrame:
     """
-    Slices and transposes data from time-series format into a (features, target)
-    format that we can use to train Supervised ML models
+    Incremental version of `transform_raw_data_into_ts_data`.
+
+    Only the hours from `get_incremental_fetch_start` onwards are
+    re-aggregated, so `rides` must contain all the rides picked up since then
+    (older ones are ignored). The persisted aggregate and watermark are
+    updated, hours older than `retention` are dropped from it, and only the
+    (pickup_hour, pickup_location_id) rows that are new or whose count
+    changed are returned, in the same format as `transform_raw_data_into_ts_data`.
+    """
+    stored, watermark = load_hourly_aggregate(path)
+
+    from_hour = get_incremental_fetch_start(late_arrival_lookback, path)
+    if from_hour is not None:
+        rides = rides[rides.pickup_datetime >= from_hour]
+    if rides.empty:
+        return stored.iloc[:0]
+
+    pickup_hour = rides['pickup_datetime'].dt.floor('H')
+    agg_rides = rides.groupby([pickup_hour, rides['pickup_location_id']]).size() \
+        .rename('rides').reset_index() \
+        .rename(columns={'pickup_datetime': 'pickup_hour'})
+
+    # recompute every slot of the window, for all locations we have ever seen
+    if from_hour is None:
+        from_hour = agg_rides['pickup_hour'].min()
+    to_hour = agg_rides['pickup_hour'].max()
+    max_location_id = max(agg_rides['pickup_location_id'].max(),
+                          stored['pickup_location_id'].max() if not stored.empty else 0)
+    recomputed = add_missing_slots(
+        agg_rides, range(1, max_location_id + 1), from_hour, to_hour)
+
+    # keep only the slots that are new or changed
+    merged = recomputed.merge(
+        stored, on=['pickup_hour', 'pickup_location_id'], how='left',
+        suffixes=('', '_stored'))
+    changed = recomputed[(merged['rides'] != merged['rides_stored']).values]
+
+    # replace the window in the stored aggregate and persist it
+    is_outside_window = (stored.pickup_hour < from_hour) | (stored.pickup_hour > to_hour)
+    stored = pd.concat([stored[is_outside_window], recomputed], ignore_index=True)
+    stored = stored[stored.pickup_hour > to_hour - retention] \
+        .sort_values(['pickup_location_id', 'pickup_hour'], ignore_index=True)
+
+    watermark = rides['pickup_datetime'].max() if watermark is None \
+        else max(watermark, rides['pickup_datetime'].max())
+
+    table = pa.Table.from_pandas(stored, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}), b'watermark': str(watermark).encode()})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+    print(f'Aggregated rides up to {watermark}, {len(changed)} changed rows')
+
+    return changed.reset_index(drop=True)
+
+def pivot_ts_data(
+    ts_data: pd.DataFrame
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
-    assert set(ts_data.columns) == {'pickup_hour', 'rides', 'pickup_location_id'}
+    Pivots time-series data in long format into dense (locations x hours)
+    arrays, keeping for every location its rows in the order they appear in
+    `ts_data`.
+
+    Returns
+    - location_ids, in order of first appearance
+    - rides, float32 array of shape (n_locations, n_hours)
+    - row_positions, int64 array of shape (n_locations, n_hours) with the
+      position in `ts_data` of each value, or -1 where a location has fewer
+      rows than the longest one
+    """
+    location_codes, location_ids = pd.factorize(ts_data['pickup_location_id'])
+    n_rows_per_location = np.bincount(location_codes, minlength=len(location_ids))
+    n_hours = n_rows_per_location.max() if len(location_ids) > 0 else 0
 
-    location_ids = ts_data['pickup_location_id'].unique()
-    features = pd.DataFrame()
-    targets = pd.DataFrame()
-    
-    for location_id in tqdm(location_ids):
-        
-        # keep only ts data for this `location_id`
-        ts_data_one_location = ts_data.loc[
-            ts_data.pickup_location_id == location_id, 
-            ['pickup_hour', 'rides']
-        ]
-
-        # pre-compute cutoff indices to split dataframe rows
-        indices = get_cutoff_indices_features_and_target(
-            ts_data_one_location,
-            input_seq_len,
-            step_size
+    # position of every row within its location
+    hour_positions = pd.Series(location_codes).groupby(location_codes).cumcount().values
+
+    rides = np.zeros((len(location_ids), n_hours), dtype=np.float32)
+    rides[location_codes, hour_positions] = ts_data['rides'].values
+
+    row_positions = np.full((len(location_ids), n_hours), -1, dtype=np.int64)
+    row_positions[location_codes, hour_positions] = np.arange(len(ts_data))
+
+    return np.asarray(location_ids), rides, row_positions
+
+class WindowedFeatures:
+    """
+    Lazy (features, target) examples cut from a single (locations x hours)
+    array of rides.
+
+    Every example only stores the location row and first hour of its window,
+    so the ~input_seq_len columns per example are never duplicated across
+    overlapping windows. Windows are exposed as strided views and copied into
+    a contiguous matrix only for the rows you ask for, e.g. one batch at a
+    time when training LightGBM with `model.get_lgb_dataset`.
+    """
+    def __init__(
+        self,
+        rides: np.ndarray,
+        location_ids: np.ndarray,
+        location_index: np.ndarray,
+        first_index: np.ndarray,
+        pickup_hour: pd.Series,
+        input_seq_len: int,
+    ):
+        self.rides = rides
+        self.location_ids = location_ids
+        self.location_index = location_index
+        self.first_index = first_index
+        self.pickup_hour = pickup_hour.reset_index(drop=True)
+        self.input_seq_len = input_seq_len
+
+        # (n_locations, n_hours - input_seq_len, input_seq_len + 1) view
+        self._windows = sliding_window_view(rides, input_seq_len + 1, axis=1)
+
+    @classmethod
+    def from_ts_data(
+        cls,
+        ts_data: pd.DataFrame,
+        input_seq_len: int,
+        step_size: int
+    ) -> 'WindowedFeatures':
+        """
+        Same examples, in the same order, as
+        `transform_ts_data_into_features_and_target`
+        """
+        assert set(ts_data.columns) == {'pickup_hour', 'rides', 'pickup_location_id'}
+
+        location_ids, rides, row_positions = pivot_ts_data(ts_data)
+        n_rows_per_location = (row_positions >= 0).sum(axis=1)
+
+        # first index of every window, shared by all locations, and a mask of
+        # the windows that fit in each location's own time-series
+        n_hours = rides.shape[1]
+        first_indices = np.arange(0, max(n_hours - input_seq_len - 1, 0), step_size)
+        is_valid = first_indices[None, :] < (n_rows_per_location - input_seq_len - 1)[:, None]
+
+        location_index, window_index = np.nonzero(is_valid)
+        first_index = first_indices[window_index]
+        target_positions = row_positions[location_index, first_index + input_seq_len]
+
+        if rides.shape[1] < input_seq_len + 1:
+            # not a single window fits, pad so the sliding view can be built
+            rides = np.zeros((len(location_ids), input_seq_len + 1), dtype=np.float32)
+
+        return cls(
+            rides=rides,
+            location_ids=location_ids,
+            location_index=location_index,
+            first_index=first_index,
+            pickup_hour=ts_data['pickup_hour'].iloc[target_positions],
+            input_seq_len=input_seq_len,
         )
 
-        # slice and transpose data into numpy arrays for features and targets
-        n_examples = len(indices)
-        x = np.ndarray(shape=(n_examples, input_seq_len), dtype=np.float32)
-        y = np.ndarray(shape=(n_examples), dtype=np.float32)
-        pickup_hours = []
-        
-        for i, idx in enumerate(indices):
-            x[i, :] = ts_data_one_location.iloc[idx[0]:idx[1]]['rides'].values
-            y[i] = ts_data_one_location.iloc[idx[1]:idx[2]]['rides'].values
-            pickup_hours.append(ts_data_one_location.iloc[idx[1]]['pickup_hour'])
+    def __len__(self) -> int:
+        return len(self.first_index)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self), self.input_seq_len
+
+    @property
+    def columns(self) -> List[str]:
+        return [f'rides_previous_{i+1}_hour' for i in reversed(range(self.input_seq_len))]
+
+    @property
+    def pickup_location_id(self) -> np.ndarray:
+        return self.location_ids[self.location_index]
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self._windows[self.location_index, self.first_index, self.input_seq_len]
+
+    def window(self, i: int) -> np.ndarray:
+        """Read-only view on the past rides of example `i`, no data is copied"""
+        return self._windows[self.location_index[i], self.first_index[i], :self.input_seq_len]
+
+    def to_numpy(self, rows=None) -> np.ndarray:
+        """
+        Contiguous float32 matrix with the past rides of the examples in
+        `rows` (an int, slice, index array or boolean mask). All of them if None.
+        """
+        if rows is None:
+            rows = slice(None)
+        return self._windows[
+            self.location_index[rows], self.first_index[rows], :self.input_seq_len]
+
+    def to_frame(self, rows=None) -> pd.DataFrame:
+        """
+        Features of the examples in `rows` as a pandas DataFrame, in the format
+        returned by `transform_ts_data_into_features_and_target`
+        """
+        if rows is None:
+            rows = slice(None)
+        elif isinstance(rows, (int, np.integer)):
+            rows = [rows]
 
         # numpy -> pandas
-        features_one_location = pd.DataFrame(
-            x,
-            columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(input_seq_len))]
+        features = pd.DataFrame(self.to_numpy(rows), columns=self.columns)
+        features['pickup_hour'] = self.pickup_hour.iloc[rows].array
+        features['pickup_location_id'] = self.location_ids[self.location_index[rows]]
+        return features
+
+    def take(self, rows) -> 'WindowedFeatures':
+        """Subset of the examples, backed by the same rides array"""
+        return WindowedFeatures(
+            rides=self.rides,
+            location_ids=self.location_ids,
+            location_index=self.location_index[rows],
+            first_index=self.first_index[rows],
+            pickup_hour=self.pickup_hour.iloc[rows],
+            input_seq_len=self.input_seq_len,
         )
-        features_one_location['pickup_hour'] = pickup_hours
-        features_one_location['pickup_location_id'] = location_id
 
-        # numpy -> pandas
-        targets_one_location = pd.DataFrame(y, columns=[f'target_rides_next_hour'])
+    def split(self, cutoff_date: datetime) -> Tuple['WindowedFeatures', 'WindowedFeatures']:
+        """Train/test split by `pickup_hour`, like `data_split.train_test_split`"""
+        is_train = (self.pickup_hour < cutoff_date).values
+        return self.take(is_train), self.take(~is_train)
 
-        # concatenate results
-        features = pd.concat([features, features_one_location])
-        targets = pd.concat([targets, targets_one_location])
+    def iter_batches(self, batch_size: int) -> Iterator[np.ndarray]:
+        """Yields contiguous float32 matrices with at most `batch_size` rows"""
+        for start in range(0, len(self), batch_size):
+            yield self.to_numpy(slice(start, start + batch_size))
+
+def transform_ts_data_into_features_and_target(
+    ts_data: pd.DataFrame,
+    input_seq_len: int,
+    step_size: int
+) -> pd.DataFrame:
+    """
+    Slices and transposes data from time-series format into a (features, target)
+    format that we can use to train Supervised ML models
+
+    The data is pivoted into a (locations x hours) array and all windows are
+    cut at once with `sliding_window_view`, using the same cutoff indices as
+    `get_cutoff_indices_features_and_target`. Use `WindowedFeatures` directly
+    to avoid materializing the whole feature matrix.
+    """
+    windowed_features = WindowedFeatures.from_ts_data(ts_data, input_seq_len, step_size)
 
-    features.reset_index(inplace=True, drop=True)
-    targets.reset_index(inplace=True, drop=True)
+    features = windowed_features.to_frame()
+    targets = pd.Series(windowed_features.targets, name='target_rides_next_hour')
 
     print(len(features))
 
-    return features, targets['target_rides_next_hour']
+    return features, targets
 
 def get_cutoff_indices_features_and_target(
     data: pd.DataFrame,
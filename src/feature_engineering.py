@@ -0,0 +1,66 @@
+"""
+Scikit-learn transformers of the `model.get_pipeline` pipelines, kept apart
+from `model` because scikit-learn is slow to import
+"""
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from model import get_model_input, get_model_input_columns
+
+
+class FeaturesEngineer(BaseEstimator, TransformerMixin):
+    """
+    Scikit-learn data transformation that builds the model input from the
+    `rides_previous_*_hour`, `pickup_location_id` and `pickup_hour` columns,
+    adding
+    - one column per entry of `lag_averages`, with the average rides of its lags
+    - hour
+    - day_of_week
+
+    Only these columns are computed: the lag columns are selected into one
+    array and copied into the float matrix LightGBM reads, with no
+    intermediate frames. The input frame is not modified.
+    """
+    def __init__(self, lag_averages: Optional[Dict[str, List[int]]] = None):
+        self.lag_averages = lag_averages
+
+    def fit(self, x, y=None):
+        return self
+
+    def transform(self, x, y=None):
+        n_lags = sum(1 for c in x.columns if c.startswith('rides_previous_'))
+        columns = get_model_input_columns(n_lags, self.lag_averages)
+
+        x_ = get_model_input(
+            x[columns[:n_lags]].to_numpy(),
+            x['pickup_location_id'].to_numpy(),
+            x['pickup_hour'],
+            self.lag_averages,
+        )
+        return pd.DataFrame(x_, columns=columns, index=x.index)
+
+
+class TemporalFeaturesEngineer(BaseEstimator, TransformerMixin):
+    """
+    Scikit-learn data transformation that adds 2 columns
+    - hour
+    - day_of_week
+    and removes the `pickup_hour` datetime column.
+
+    Kept for the pipelines pickled before `FeaturesEngineer`.
+    """
+    def fit(self, x, y=None):
+        return self
+    
+    def transform(self, x, y=None):
+        
+        # Generate numeric columns from datetime
+        temporal_features = pd.DataFrame({
+            'hour': x['pickup_hour'].dt.hour,
+            'day_of_week': x['pickup_hour'].dt.dayofweek,
+        }, index=x.index)
+
+        return pd.concat([x.drop(columns=['pickup_hour']), temporal_features],
+                         axis=1, copy=False)
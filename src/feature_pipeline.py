@@ -0,0 +1,112 @@
+"""
+Hourly feature pipeline, from notebook 12: aggregates the rides of the last
+28 days per hour and location and stores them in the feature group.
+
+    python src/feature_pipeline.py [--current-date 2023-02-28T09:00] [--incremental]
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Optional
+
+from timing import StageTimer
+
+
+def fetch_batch_raw_data(from_date: datetime, to_date: datetime) -> 'pd.DataFrame':
+    """
+    We cannot import the current data from the data warehouse, so we
+    simulate production data by sampling historical data from 52 weeks ago
+    and shifting it to pretend it is recent
+    """
+    import pandas as pd
+    from data import load_raw_data
+
+    from_date_ = from_date - timedelta(days=7*52)
+    to_date_ = to_date - timedelta(days=7*52)
+    print(f'Fetching rides from {from_date_} to {to_date_}')
+
+    # we only read the rides between from_date_ and to_date_ from the files
+    rides = load_raw_data(year=from_date_.year, months=from_date_.month,
+                          from_date=from_date_, to_date=to_date_)
+    if (to_date_.year, to_date_.month) != (from_date_.year, from_date_.month):
+        rides_2 = load_raw_data(year=to_date_.year, months=to_date_.month,
+                                from_date=from_date_, to_date=to_date_)
+        rides = pd.concat([rides, rides_2])
+
+    # shift the data to pretend this is recent data
+    rides['pickup_datetime'] += timedelta(days=7*52)
+
+    rides.sort_values(by=['pickup_location_id', 'pickup_datetime'], inplace=True)
+
+    return rides
+
+
+def run(
+    current_date: Optional[datetime] = None,
+    incremental: bool = False,
+    wait_for_job: bool = False,
+):
+    """
+    Fetches the rides of the 28 days before `current_date`, by default the
+    current hour, and inserts the rows of their hourly time-series that are
+    not in the feature group yet, or changed.
+
+    With `incremental`, only the rides since the watermark of the local
+    hourly aggregate are fetched, and only the new or changed rows are
+    written. Without a local aggregate, e.g. on the first run, all 28 days
+    are processed.
+    """
+    import pandas as pd
+
+    timer = StageTimer('feature pipeline')
+
+    if current_date is None:
+        current_date = datetime.utcnow()
+    current_date = pd.to_datetime(current_date).floor('H')
+    print(f'{current_date=}')
+
+    # we fetch raw data for the last 28 days to add redundancy to our data pipeline
+    fetch_data_to = current_date
+    fetch_data_from = current_date - timedelta(days=28)
+
+    if incremental:
+        from data import get_incremental_fetch_start
+        fetch_start = get_incremental_fetch_start()
+        if fetch_start is not None:
+            fetch_data_from = max(fetch_data_from, fetch_start)
+
+    with timer.stage('fetch raw data'):
+        rides = fetch_batch_raw_data(from_date=fetch_data_from, to_date=fetch_data_to)
+
+    with timer.stage('transform into time-series'):
+        if incremental:
+            from data import update_hourly_aggregate
+            ts_data = update_hourly_aggregate(rides)
+        else:
+            from data import transform_raw_data_into_ts_data
+            ts_data = transform_raw_data_into_ts_data(rides)
+    print(f'{len(ts_data)} rows of time-series data')
+
+    with timer.stage('insert into feature group'):
+        import config as config
+        from feature_store_api import upsert_features
+        # the incremental aggregate only returns new or changed rows already
+        upsert_features(config.FEATURE_GROUP_METADATA, ts_data, diff=not incremental,
+                        wait_for_job=wait_for_job)
+
+    timer.report()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--current-date', type=datetime.fromisoformat, default=None,
+                        help='UTC hour to run the pipeline for, by default the current one')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only aggregate and insert the rides since the last run')
+    parser.add_argument('--wait-for-job', action='store_true',
+                        help='wait for the Hopsworks materialization job to finish')
+    args = parser.parse_args()
+
+    run(current_date=args.current_date, incremental=args.incremental,
+        wait_for_job=args.wait_for_job)
@@ -1,10 +1,16 @@
-from typing import Optional, List
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Optional, List
 from dataclasses import dataclass
+from datetime import datetime
+from threading import RLock
+from time import monotonic
 
-import hsfs
-import hopsworks
-
-import config as config
+# the Hopsworks SDKs are slow to import, so they are only imported when we
+# log in. `config` imports this module, so it is imported when used too.
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+    import hsfs
+    import hopsworks
 
 @dataclass
 class FeatureGroupConfig:
@@ -21,66 +27,310 @@ class FeatureViewConfig:
     version: int
     feature_group: FeatureGroupConfig
 
-def get_feature_store() -> hsfs.feature_store.FeatureStore:
+class _SessionRegistry:
+    """
+    Process-wide memo of the Hopsworks project and the handles we get from it
+    (feature store, feature groups, feature views, model registry).
+
+    The first call logs in and every handle is fetched once. All of them are
+    dropped together `config.HOPSWORKS_SESSION_TTL` seconds after login, so
+    the next call logs in again. Access is serialized with a re-entrant lock,
+    so concurrent threads share a single login.
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._handles: Dict[Hashable, object] = {}
+        self._logged_in_at: Optional[float] = None
+
+    def get(self, key: Hashable, factory: Callable[[], object]):
+        import config as config
+
+        with self._lock:
+            if self._logged_in_at is not None and \
+                    monotonic() - self._logged_in_at > config.HOPSWORKS_SESSION_TTL:
+                self.clear()
+
+            if key not in self._handles:
+                self._handles[key] = factory()
+                if key == 'project':
+                    self._logged_in_at = monotonic()
+
+            return self._handles[key]
+
+    def clear(self):
+        with self._lock:
+            self._handles.clear()
+            self._logged_in_at = None
 
-    project = hopsworks.login(
+_session = _SessionRegistry()
+
+def clear_session():
+    """Forgets all Hopsworks handles, the next call logs in again"""
+    _session.clear()
+
+def get_hopsworks_project() -> 'hopsworks.project.Project':
+    import hopsworks
+    import config as config
+
+    return _session.get('project', lambda: hopsworks.login(
         project=config.HOPSWORKS_PROJECT_NAME,
         api_key_value=config.HOPSWORKS_API_KEY
-    )
-    return project.get_feature_store()
+    ))
+
+def _use_local_backend() -> bool:
+    import config as config
+    return config.settings.feature_store_backend == 'local'
+
+def get_feature_store() -> 'hsfs.feature_store.FeatureStore':
+    """
+    The Hopsworks feature store, or with FEATURE_STORE_BACKEND=local a
+    `local_feature_store.LocalFeatureStore` with the same interface
+    """
+    if _use_local_backend():
+        from local_feature_store import LocalFeatureStore
+        from paths import LOCAL_FEATURE_STORE_DIR
+        return _session.get(
+            'feature_store', lambda: LocalFeatureStore(LOCAL_FEATURE_STORE_DIR))
+
+    return _session.get(
+        'feature_store', lambda: get_hopsworks_project().get_feature_store())
+
+def get_model_registry():
+
+    if _use_local_backend():
+        from local_feature_store import LocalModelRegistry
+        from paths import MODELS_DIR
+        return _session.get('model_registry', lambda: LocalModelRegistry(MODELS_DIR))
+
+    return _session.get(
+        'model_registry', lambda: get_hopsworks_project().get_model_registry())
 
 def get_feature_group(
     name: str,
     version: Optional[int] = 1
-    ) -> hsfs.feature_group.FeatureGroup:
+    ) -> 'hsfs.feature_group.FeatureGroup':
 
-    return get_feature_store().get_feature_group(
+    return _session.get(('feature_group', name, version), lambda: get_feature_store().get_feature_group(
         name=name,
         version=version,
-    )
+    ))
 
 def get_or_create_feature_group(
     feature_group_metadata: FeatureGroupConfig
-) -> hsfs.feature_group.FeatureGroup:
+) -> 'hsfs.feature_group.FeatureGroup':
 
-    return get_feature_store().get_or_create_feature_group(
+    key = ('feature_group', feature_group_metadata.name, feature_group_metadata.version)
+    return _session.get(key, lambda: get_feature_store().get_or_create_feature_group(
         name=feature_group_metadata.name,
         version=feature_group_metadata.version,
         description=feature_group_metadata.description,
         primary_key=feature_group_metadata.primary_key,
         event_time=feature_group_metadata.event_time,
         online_enabled=feature_group_metadata.online_enabled
-    )
+    ))
+
+def get_feature_view(
+    name: str,
+    version: Optional[int] = 1
+) -> 'hsfs.feature_view.FeatureView':
+
+    return _session.get(('feature_view', name, version), lambda: get_feature_store().get_feature_view(
+        name=name,
+        version=version,
+    ))
+
+def get_or_create_feature_view_from_query(
+    name: str,
+    version: int,
+    query: 'hsfs.constructor.query.Query',
+) -> 'hsfs.feature_view.FeatureView':
+
+    def _get_or_create():
+        # create feature view if it doesn't exist
+        try:
+            get_feature_store().create_feature_view(
+                name=name,
+                version=version,
+                query=query
+            )
+        except:
+            print('Feature view already exists, skipping creation.') #fix this
+
+        return get_feature_view(name=name, version=version)
+
+    return _session.get(('feature_view', name, version), _get_or_create)
 
 def get_or_create_feature_view(
     feature_view_metadata: FeatureViewConfig
-) -> hsfs.feature_view.FeatureView:
-
-    # get pointer to the feature store
-    feature_store = get_feature_store()
+) -> 'hsfs.feature_view.FeatureView':
 
     # get pointer to the feature group
     # from src.config import FEATURE_GROUP_METADATA
-    feature_group = feature_store.get_feature_group(
+    feature_group = get_feature_group(
         name=feature_view_metadata.feature_group.name,
         version=feature_view_metadata.feature_group.version
     )
 
-    # create feature view if it doesn't exist
-    try:
-        feature_store.create_feature_view(
-            name=feature_view_metadata.name,
-            version=feature_view_metadata.version,
-            query=feature_group.select_all()
-        )
-    except:
-        print('Feature view already exists, skipping creation.') #fix this
-    
-    # get feature view
-    feature_store = get_feature_store()
-    feature_view = feature_store.get_feature_view(
+    return get_or_create_feature_view_from_query(
         name=feature_view_metadata.name,
         version=feature_view_metadata.version,
+        query=feature_group.select_all()
     )
 
-    return feature_view
\ No newline at end of file
+def feature_group_exists(feature_group: 'hsfs.feature_group.FeatureGroup') -> bool:
+    """
+    Whether `feature_group` is saved in the feature store. Hopsworks only
+    saves a feature group created by `get_or_create_feature_group` with its
+    first insert, until then it has no id and cannot be queried.
+    """
+    return feature_group.id is not None
+
+def _to_utc(value) -> 'pd.Timestamp':
+    """Naive datetimes are assumed to be in UTC"""
+    import pandas as pd
+    return pd.to_datetime(value, utc=True)
+
+def read_time_range(
+    feature_group_metadata: FeatureGroupConfig,
+    from_date: datetime,
+    to_date: datetime,
+    location_ids: Optional[List[int]] = None,
+    features: Optional[List[str]] = None,
+) -> 'pd.DataFrame':
+    """
+    Rows of the feature group with `from_date <= event_time <= to_date`, and
+    `pickup_location_id` in `location_ids` if given.
+
+    The bounds, in UTC, and the locations are filters of the query, so the
+    store only sends the requested slice. The rows read and the rows within
+    the bounds are kept in `attrs['rows_fetched']` and `attrs['rows_used']`.
+
+    A feature group without any insert yet has no rows, so an empty frame is
+    returned, with the `features` or the primary key as columns.
+    """
+    import pandas as pd
+
+    from_date = _to_utc(from_date)
+    to_date = _to_utc(to_date)
+
+    feature_group = get_or_create_feature_group(feature_group_metadata)
+    if not feature_group_exists(feature_group):
+        print(f'{feature_group_metadata.name} has no rows yet')
+        data = pd.DataFrame(columns=features or feature_group_metadata.primary_key)
+        data.attrs['rows_fetched'] = data.attrs['rows_used'] = 0
+        return data
+
+    # Hopsworks filters timestamps by unix time in milliseconds
+    event_time = getattr(feature_group, feature_group_metadata.event_time)
+    query = feature_group.select(features) if features else feature_group.select_all()
+    query = query \
+        .filter(event_time >= from_date.value // 10**6) \
+        .filter(event_time <= to_date.value // 10**6)
+    if location_ids is not None:
+        query = query.filter(feature_group.pickup_location_id.isin(list(location_ids)))
+
+    data = query.read()
+    rows_fetched = len(data)
+
+    # the query returns exactly the slice, this only guards against stores
+    # with other bounds semantics
+    is_used = _to_utc(data[feature_group_metadata.event_time]).between(from_date, to_date).values
+    if location_ids is not None:
+        is_used &= data['pickup_location_id'].isin(location_ids).values
+    if not is_used.all():
+        data = data[is_used].copy()
+
+    data.attrs['rows_fetched'] = rows_fetched
+    data.attrs['rows_used'] = len(data)
+    print(f'Read {len(data)} rows of {feature_group_metadata.name} between {from_date} '
+          f'and {to_date} ({rows_fetched} fetched)')
+    return data
+
+def _changed_rows(
+    data: 'pd.DataFrame',
+    stored: 'pd.DataFrame',
+    primary_key: List[str],
+    event_time: str,
+) -> 'np.ndarray':
+    """Mask of the rows of `data` whose primary key is not in `stored`, or with other values"""
+    import numpy as np
+
+    value_columns = [c for c in data.columns if c not in primary_key]
+    if stored.empty or any(c not in stored.columns for c in value_columns):
+        return np.ones(len(data), dtype=bool)
+
+    # event times compared in UTC, whatever the store returns
+    left = data[primary_key + value_columns].assign(**{event_time: _to_utc(data[event_time])})
+    right = stored[primary_key + value_columns].assign(**{event_time: _to_utc(stored[event_time])})
+    merged = left.merge(right, on=primary_key, how='left', suffixes=('', '_stored'),
+                        indicator=True)
+
+    is_changed = (merged['_merge'] == 'left_only').values
+    for column in value_columns:
+        new, old = merged[column], merged[f'{column}_stored']
+        is_changed |= ((new != old) & ~(new.isna() & old.isna())).values
+    return is_changed
+
+def upsert_features(
+    feature_group_metadata: FeatureGroupConfig,
+    data: 'pd.DataFrame',
+    diff: bool = True,
+    batch_size: int = 50_000,
+    max_retries: int = 3,
+    backoff_seconds: float = 5.0,
+    wait_for_job: bool = False,
+) -> int:
+    """
+    Inserts `data` into the feature group, and returns the number of rows
+    sent.
+
+    With `diff`, the rows already stored with the same values are dropped
+    first, reading the stored rows of the same time range with
+    `read_time_range`, so writing the same data twice sends nothing. Into a
+    feature group without any insert yet, e.g. on the first run, all rows
+    are sent.
+
+    The rows are sent in batches of at most `batch_size`, and a failed batch
+    is retried `max_retries` times, waiting `backoff_seconds` and then twice
+    as long every time. With `wait_for_job` every batch waits for its own
+    materialization job, since Hopsworks runs them independently, so it
+    returns once all rows are materialized.
+    """
+    from time import sleep
+
+    if diff and not data.empty:
+        event_time = feature_group_metadata.event_time
+        stored = read_time_range(
+            feature_group_metadata,
+            _to_utc(data[event_time]).min(),
+            _to_utc(data[event_time]).max(),
+            features=list(data.columns),
+        )
+        is_changed = _changed_rows(data, stored, feature_group_metadata.primary_key, event_time)
+        print(f'{is_changed.sum()} of {len(data)} rows are new or changed')
+        data = data[is_changed]
+
+    if data.empty:
+        return 0
+
+    feature_group = get_or_create_feature_group(feature_group_metadata)
+    n_batches = (len(data) + batch_size - 1) // batch_size
+    for i, start in enumerate(range(0, len(data), batch_size), start=1):
+        batch = data.iloc[start:start + batch_size]
+        write_options = {'wait_for_job': wait_for_job}
+
+        for attempt in range(max_retries + 1):
+            try:
+                feature_group.insert(batch, write_options=write_options)
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                delay = backoff_seconds * 2 ** attempt
+                print(f'Insert of batch {i}/{n_batches} failed ({e}), retrying in {delay:.0f}s')
+                sleep(delay)
+
+        print(f'Inserted batch {i}/{n_batches} of {feature_group_metadata.name}, '
+              f'{min(start + batch_size, len(data))}/{len(data)} rows')
+
+    return len(data)
@@ -0,0 +1,199 @@
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+
+class CacheStorage(ABC):
+    """
+    Where `CachedFeatureView` keeps the rows of each cached hour
+    """
+    @abstractmethod
+    def read(self, hours: List[pd.Timestamp]) -> pd.DataFrame:
+        """Rows of all the given cached hours"""
+
+    @abstractmethod
+    def write(self, hour: pd.Timestamp, data: pd.DataFrame):
+        """Stores the rows of one hour, replacing the previous ones"""
+
+    @abstractmethod
+    def delete(self, hour: pd.Timestamp):
+        """Removes one hour from the cache"""
+
+    @abstractmethod
+    def entries(self) -> Dict[pd.Timestamp, Tuple[int, float]]:
+        """(size in bytes, unix time it was cached) of every cached hour"""
+
+
+class MemoryCacheStorage(CacheStorage):
+    """Keeps the cached hours in a dict, for tests and short-lived processes"""
+
+    def __init__(self):
+        self._data: Dict[pd.Timestamp, Tuple[pd.DataFrame, float]] = {}
+
+    def read(self, hours: List[pd.Timestamp]) -> pd.DataFrame:
+        return pd.concat([self._data[hour][0] for hour in hours], ignore_index=True)
+
+    def write(self, hour: pd.Timestamp, data: pd.DataFrame):
+        self._data[hour] = (data.copy(), time())
+
+    def delete(self, hour: pd.Timestamp):
+        self._data.pop(hour, None)
+
+    def entries(self) -> Dict[pd.Timestamp, Tuple[int, float]]:
+        return {
+            hour: (int(data.memory_usage(index=False).sum()), cached_at)
+            for hour, (data, cached_at) in self._data.items()
+        }
+
+
+class ParquetCacheStorage(CacheStorage):
+    """
+    One parquet file per cached hour, `pickup_hour=YYYYMMDDHH.parquet`, in
+    `directory`. The file modification time is the time it was cached.
+    """
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, hour: pd.Timestamp) -> Path:
+        return self.directory / f'pickup_hour={hour:%Y%m%d%H}.parquet'
+
+    def read(self, hours: List[pd.Timestamp]) -> pd.DataFrame:
+        # a single multi-threaded scan over all files
+        paths = [str(self._path(hour)) for hour in hours]
+        return ds.dataset(paths, format='parquet').to_table().to_pandas()
+
+    def write(self, hour: pd.Timestamp, data: pd.DataFrame):
+        # a temporary file of its own per write, so processes sharing the
+        # directory never write to the same file, then renamed atomically
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                                         delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+        try:
+            data.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self._path(hour))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def delete(self, hour: pd.Timestamp):
+        self._path(hour).unlink(missing_ok=True)
+
+    def entries(self) -> Dict[pd.Timestamp, Tuple[int, float]]:
+        entries = {}
+        for path in self.directory.glob('pickup_hour=*.parquet'):
+            hour = pd.to_datetime(path.stem.split('=')[1], format='%Y%m%d%H', utc=True)
+            stat = path.stat()
+            entries[hour] = (stat.st_size, stat.st_mtime)
+        return entries
+
+
+def _to_utc(value) -> pd.Timestamp:
+    """Naive datetimes are assumed to be in UTC"""
+    return pd.to_datetime(value, utc=True)
+
+
+class CachedFeatureView:
+    """
+    Read-through cache in front of a feature view, or anything with the same
+    `get_batch_data(start_time, end_time)` method.
+
+    Rows are cached per `event_time` hour. `get_batch_data` serves the hours
+    that are already cached from `storage` and only fetches the missing ones,
+    grouped in contiguous ranges. Hours cached more than `max_age` ago are
+    refetched, and the oldest hours are evicted once the cache takes more than
+    `max_size_bytes`.
+
+    The hours within `refresh_window` of the current time are always fetched
+    and never cached, since the feature pipeline still rewrites them when
+    rides arrive late (`data.update_hourly_aggregate` recomputes the 3 hours
+    before its watermark) or an hour was only partially written.
+    """
+    def __init__(
+        self,
+        feature_view,
+        storage: CacheStorage,
+        max_age: timedelta = timedelta(days=1),
+        refresh_window: timedelta = timedelta(hours=6),
+        max_size_bytes: int = 256 * 1024 * 1024,
+        event_time: str = 'pickup_hour',
+    ):
+        self.feature_view = feature_view
+        self.storage = storage
+        self.max_age = max_age
+        self.refresh_window = refresh_window
+        self.max_size_bytes = max_size_bytes
+        self.event_time = event_time
+
+    def _evict(self, keep: Optional[set] = None) -> Dict[pd.Timestamp, Tuple[int, float]]:
+        """Drops expired hours, then the oldest ones while the cache is too big"""
+        entries = self.storage.entries()
+        now = time()
+        for hour, (_, cached_at) in list(entries.items()):
+            if now - cached_at > self.max_age.total_seconds():
+                self.storage.delete(hour)
+                del entries[hour]
+
+        total_size = sum(size for size, _ in entries.values())
+        for hour in sorted(entries):
+            if total_size <= self.max_size_bytes:
+                break
+            if keep is not None and hour in keep:
+                continue
+            total_size -= entries[hour][0]
+            self.storage.delete(hour)
+            del entries[hour]
+
+        return entries
+
+    def _fetch(self, from_hour: pd.Timestamp, to_hour: pd.Timestamp) -> pd.DataFrame:
+        """Rows of the hours in [from_hour, to_hour] from the feature view"""
+        data = self.feature_view.get_batch_data(
+            start_time=from_hour.to_pydatetime(),
+            end_time=(to_hour + timedelta(hours=1)).to_pydatetime(),
+        )
+        event_time = _to_utc(data[self.event_time])
+        return data[event_time.between(from_hour, to_hour).values]
+
+    def get_batch_data(self, start_time: datetime, end_time: datetime) -> pd.DataFrame:
+        """
+        Rows with `start_time <= event_time <= end_time`
+        """
+        hours = pd.date_range(
+            _to_utc(start_time).ceil('H'), _to_utc(end_time).floor('H'), freq='H')
+        # hours the feature pipeline may still rewrite
+        refresh_from = (pd.Timestamp.now(tz='UTC') - self.refresh_window).floor('H')
+        cached_hours = {hour for hour in self._evict(keep=set(hours)) if hour < refresh_from}
+        missing_hours = [hour for hour in hours if hour not in cached_hours]
+
+        # fetch contiguous ranges of missing hours and cache them hour by hour
+        fetched = []
+        if missing_hours:
+            run_ids = (pd.Series(missing_hours).diff() != timedelta(hours=1)).cumsum()
+            for _, run in pd.Series(missing_hours).groupby(run_ids.values):
+                data = self._fetch(run.iloc[0], run.iloc[-1])
+                event_time = _to_utc(data[self.event_time]).values
+                for hour, data_one_hour in data.groupby(event_time):
+                    # hours without data are not cached, they may arrive later
+                    if _to_utc(hour) < refresh_from:
+                        self.storage.write(_to_utc(hour), data_one_hour)
+                fetched.append(data)
+
+        print(f'Feature store cache: {len(hours) - len(missing_hours)} hours cached, '
+              f'{len(missing_hours)} hours fetched, from {refresh_from} always')
+
+        hits = [hour for hour in hours if hour in cached_hours]
+        frames = ([self.storage.read(hits)] if hits else []) + fetched
+        if not frames:
+            return pd.DataFrame()
+
+        self._evict(keep=set(hours))
+
+        return pd.concat(frames, ignore_index=True)
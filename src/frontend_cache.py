@@ -0,0 +1,167 @@
+"""
+Caches shared by the Streamlit apps, `frontend.py`, `frontend_new.py` and
+`frontend_monitoring.py`.
+
+Data is cached with `st.cache_data`, keyed on the floored UTC hour, so all
+sessions share one copy per hour, and evicted after CACHE_TTL or when more
+than CACHE_MAX_ENTRIES hours are cached. The model is a `st.cache_resource`,
+the feature store handles are shared by the process in `feature_store_api`.
+
+`start_prefetch(app)` starts a background thread that waits, every hour,
+until the inference pipeline has stored the predictions of the new hour and
+then loads the data of `app` for that hour, so page loads find it cached.
+The loaders are also keyed on `is_prefetched(hour)`, so the data of page
+loads before the predictions were ready is never served after, and the
+prefetch fills new entries without clearing any.
+"""
+import threading
+from datetime import datetime, timedelta
+from time import sleep
+from typing import Optional
+
+import pandas as pd
+import streamlit as st
+
+# hours of data kept in memory, the current one and the previous ones
+CACHE_TTL = timedelta(hours=2)
+CACHE_MAX_ENTRIES = 3
+
+# the inference pipeline runs after the feature pipeline at the start of
+# every hour, we check for its predictions every PREFETCH_POLL_INTERVAL
+# until PREFETCH_TIMEOUT after the hour starts
+PREFETCH_POLL_INTERVAL = timedelta(minutes=2)
+PREFETCH_TIMEOUT = timedelta(minutes=45)
+
+MONITORING_WINDOW = timedelta(days=14)
+
+# latest hour whose predictions the prefetch thread found and loaded
+_prefetched_hour: Optional[pd.Timestamp] = None
+
+
+def get_current_hour() -> pd.Timestamp:
+    """Current hour in UTC, as a naive datetime, the key of every cached hour"""
+    return pd.to_datetime(datetime.utcnow()).floor('H')
+
+
+def is_prefetched(hour: datetime) -> bool:
+    """Whether the prefetch thread loaded the data of `hour`, part of every cache key"""
+    return _prefetched_hour is not None and pd.Timestamp(hour) == _prefetched_hour
+
+
+@st.cache_resource(show_spinner=False)
+def get_model():
+    from inference import load_model_from_registry
+    return load_model_from_registry()
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_features(current_hour: datetime, prefetched: bool = False) -> pd.DataFrame:
+    from inference import load_batch_of_features_from_store
+    return load_batch_of_features_from_store(current_hour, use_cache=True)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_model_predictions(current_hour: datetime, prefetched: bool = False) -> pd.DataFrame:
+    """Predictions of the model for `current_hour`, computed in the app"""
+    from inference import get_model_predictions
+    return get_model_predictions(get_model(), load_features(current_hour, prefetched))
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_predictions(
+    from_pickup_hour: datetime,
+    to_pickup_hour: datetime,
+    prefetched: bool = False,
+) -> pd.DataFrame:
+    """Predictions stored by the inference pipeline"""
+    from inference import load_predictions_from_store
+    return load_predictions_from_store(from_pickup_hour, to_pickup_hour)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_monitoring_rollup(current_hour: datetime, prefetched: bool = False) -> pd.DataFrame:
+    """Hourly error sums of the MONITORING_WINDOW up to `current_hour`"""
+    from monitoring import load_monitoring_rollup_from_store
+    return load_monitoring_rollup_from_store(current_hour - MONITORING_WINDOW, current_hour)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def load_top_locations_monitoring(
+    current_hour: datetime,
+    prefetched: bool = False,
+) -> pd.DataFrame:
+    """
+    Error sums per hour and location of the MONITORING_WINDOW up to
+    `current_hour`, of the locations with the most rides in the last day
+    """
+    from monitoring import get_top_locations, load_locations_monitoring_rollup_from_store
+    return load_locations_monitoring_rollup_from_store(
+        current_hour - MONITORING_WINDOW, current_hour, get_top_locations(current_hour))
+
+
+def _load_frontend(current_hour: pd.Timestamp):
+    from geometry import load_taxi_zones
+    load_taxi_zones()
+    load_model_predictions(current_hour, prefetched=True)
+
+
+def _load_frontend_new(current_hour: pd.Timestamp):
+    from geometry import load_taxi_zones
+    load_taxi_zones()
+    load_predictions(current_hour - timedelta(hours=1), current_hour, prefetched=True)
+    load_features(current_hour, prefetched=True)
+
+
+def _load_frontend_monitoring(current_hour: pd.Timestamp):
+    load_monitoring_rollup(current_hour, prefetched=True)
+    load_top_locations_monitoring(current_hour, prefetched=True)
+
+
+# what each app loads on every page load
+_APP_LOADERS = {
+    'frontend': _load_frontend,
+    'frontend_new': _load_frontend_new,
+    'frontend_monitoring': _load_frontend_monitoring,
+}
+
+
+def _predictions_are_ready(current_hour: pd.Timestamp) -> bool:
+    """Whether the inference pipeline stored the predictions of `current_hour`, uncached"""
+    from config import FEATURE_GROUP_PREDICTIONS_METADATA
+    from feature_store_api import read_time_range
+    return not read_time_range(FEATURE_GROUP_PREDICTIONS_METADATA, current_hour, current_hour,
+                               features=['pickup_location_id', 'pickup_hour']).empty
+
+
+def _prefetch_loop(app: str):
+    global _prefetched_hour
+    load = _APP_LOADERS[app]
+    prefetched_hour = None
+
+    while True:
+        current_hour = get_current_hour()
+        waited = pd.to_datetime(datetime.utcnow()) - current_hour
+
+        if current_hour != prefetched_hour and waited < PREFETCH_TIMEOUT:
+            try:
+                if _predictions_are_ready(current_hour):
+                    # new entries, page loads switch to them once all are loaded
+                    load(current_hour)
+                    prefetched_hour = _prefetched_hour = current_hour
+                    print(f'Prefetched the data of {app} for {current_hour}')
+            except Exception as e:
+                print(f'Prefetch of the data of {app} for {current_hour} failed: {e}')
+
+        sleep(PREFETCH_POLL_INTERVAL.total_seconds())
+
+
+@st.cache_resource
+def start_prefetch(app: str) -> threading.Thread:
+    """
+    Starts the prefetch thread of `app`, one of `_APP_LOADERS`, once per
+    process, whatever the number of sessions
+    """
+    thread = threading.Thread(target=_prefetch_loop, args=(app,), daemon=True,
+                              name=f'{app}-prefetch')
+    thread.start()
+    return thread
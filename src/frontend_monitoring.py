@@ -1,17 +1,27 @@
-from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
 import streamlit as st
-from sklearn.metrics import mean_absolute_error
 import plotly.express as px
 
-from monitoring import load_predictions_and_actual_values_from_store
+from frontend_cache import (
+    get_current_hour,
+    is_prefetched,
+    load_monitoring_rollup,
+    load_top_locations_monitoring,
+    start_prefetch
+)
+from metrics import compute_metrics_from_sums, get_metrics_from_sums
 
 st.set_page_config(layout="wide")
 
+# warms the cache of every new hour once the inference pipeline finishes
+start_prefetch('frontend_monitoring')
+
 # title
-current_date = pd.to_datetime(datetime.utcnow(), utc=True).floor('H')
+current_date = get_current_hour()
+# the entries the prefetch loaded once the predictions of the hour were ready
+prefetched = is_prefetched(current_date)
 st.title(f'Monitoring dashboard 🔎')
 
 progress_bar = st.sidebar.header('⚙️ Working Progress')
@@ -19,22 +29,16 @@ progress_bar = st.sidebar.progress(0)
 N_STEPS = 3
 
 
-# @st.cache_data
-def _load_predictions_and_actuals_from_store(
-    from_date: datetime,
-    to_date: datetime
-    ) -> pd.DataFrame:
-    return load_predictions_and_actual_values_from_store(from_date, to_date)
-
-with st.spinner(text="Fetching model predictions and actual values from the store"):
+with st.spinner(text="Fetching the error sums of the model predictions from the store"):
     
-    monitoring_df = _load_predictions_and_actuals_from_store(
-        from_date=current_date - timedelta(days=14),
-        to_date=current_date
-    )
-    st.sidebar.write('✅ Model predictions and actual values arrived')
+    # pre-aggregated by the monitoring pipeline, no raw rows to join,
+    # of the last 14 days
+    error_sums = load_monitoring_rollup(current_date, prefetched)
+    st.sidebar.write('✅ Model prediction errors arrived')
     progress_bar.progress(1/N_STEPS)
-    print(monitoring_df.head())
+
+    # MAE, RMSE, bias and MAPE per hour
+    metrics_per_hour = get_metrics_from_sums(error_sums)
 
 
 with st.spinner(text="Plotting aggregate MAE hour-by-hour"):
@@ -42,15 +46,7 @@ with st.spinner(text="Plotting aggregate MAE hour-by-hour"):
     st.header('Mean Absolute Error (MAE) hour-by-hour')
 
     # MAE per pickup_hour
-    # https://stackoverflow.com/a/47914634
-    mae_per_hour = (
-        monitoring_df
-        .groupby('pickup_hour')
-        .apply(lambda g: mean_absolute_error(g['rides'], g['predicted_demand']))
-        .reset_index()
-        .rename(columns={0: 'mae'})
-        .sort_values(by='pickup_hour')
-    )
+    mae_per_hour = metrics_per_hour.reset_index()
 
     fig = px.bar(
         mae_per_hour,
@@ -66,25 +62,14 @@ with st.spinner(text="Plotting MAE hour-by-hour for top locations"):
     
     st.header('Mean Absolute Error (MAE) per location and hour')
 
-    top_locations_by_demand = (
-        monitoring_df
-        .groupby('pickup_location_id')['rides']
-        .sum()
-        .sort_values(ascending=False)
-        .reset_index()
-        .head(10)['pickup_location_id']
-    )
+    # pre-aggregated too, only the rows of the top locations are read
+    metrics = compute_metrics_from_sums(load_top_locations_monitoring(current_date, prefetched))
+    top_locations_by_demand = metrics['location']['rides'].nlargest(10).index
 
     for location_id in top_locations_by_demand:
         
-        mae_per_hour = (
-            monitoring_df[monitoring_df.pickup_location_id == location_id]
-            .groupby('pickup_hour')
-            .apply(lambda g: mean_absolute_error(g['rides'], g['predicted_demand']))
+        mae_per_hour = metrics['hour_location'].xs(location_id, level='pickup_location_id') \
             .reset_index()
-            .rename(columns={0: 'mae'})
-            .sort_values(by='pickup_hour')
-        )
 
         fig = px.bar(
             mae_per_hour,
@@ -94,4 +79,4 @@ with st.spinner(text="Plotting MAE hour-by-hour for top locations"):
         st.subheader(f'{location_id=}')
         st.plotly_chart(fig, theme="streamlit", use_container_width=True, width=1000)
 
-    progress_bar.progress(3/N_STEPS)
\ No newline at end of file
+    progress_bar.progress(3/N_STEPS)
@@ -0,0 +1,106 @@
+"""
+Geometry of the NYC taxi zones for the maps of the frontends.
+
+The shapefile in `data/taxi_zones` is read, reprojected to WGS84 and
+simplified once, and stored as GeoParquet in GEOMETRY_CACHE_DIR under the
+hash of the shapefile and the tolerance, so it is rebuilt only when either
+changes. The apps then load the compact copy, once per process.
+
+    python src/geometry.py [--tolerance 0.0001]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from paths import DATA_DIR, GEOMETRY_CACHE_DIR
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+TAXI_ZONES_SHAPEFILE = DATA_DIR / 'taxi_zones' / 'taxi_zones.shp'
+
+# in degrees of WGS84, about 10 meters in NYC, invisible at the zoom of the maps
+SIMPLIFY_TOLERANCE = 0.0001
+
+# the only attributes of the zones the maps use
+TAXI_ZONES_COLUMNS = ['LocationID', 'zone', 'borough', 'geometry']
+
+# the apps and their prefetch threads build the file once per process
+_build_lock = threading.Lock()
+
+
+def _source_hash(shapefile: Path, tolerance: float) -> str:
+    """Hash of the files of `shapefile` the geometry is read from, and of `tolerance`"""
+    sha = hashlib.sha256(str(tolerance).encode())
+    for suffix in ['.shp', '.shx', '.dbf', '.prj']:
+        sha.update(shapefile.with_suffix(suffix).read_bytes())
+    return sha.hexdigest()[:16]
+
+
+def build_taxi_zones(
+    tolerance: float = SIMPLIFY_TOLERANCE,
+    shapefile: Path = TAXI_ZONES_SHAPEFILE,
+    force: bool = False,
+) -> Path:
+    """
+    Path of the GeoParquet file of the zones of `shapefile` in WGS84,
+    simplified to `tolerance` degrees, which is built only if it does not
+    exist yet or with `force`.
+    """
+    if not shapefile.exists():
+        raise Exception(f'{shapefile} does not exist, it is part of the repository')
+
+    path = GEOMETRY_CACHE_DIR / f'taxi_zones_{_source_hash(shapefile, tolerance)}.parquet'
+    with _build_lock:
+        if path.exists() and not force:
+            return path
+
+        import geopandas as gpd
+
+        zones = gpd.read_file(shapefile).to_crs('epsg:4326')[TAXI_ZONES_COLUMNS]
+        zones['geometry'] = zones.geometry.simplify(tolerance, preserve_topology=True)
+
+        # written to a file of its own and renamed, so the apps never read a
+        # truncated file, even if other processes build it at the same time
+        GEOMETRY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=GEOMETRY_CACHE_DIR, suffix='.tmp',
+                                         delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+        try:
+            zones.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return path
+
+
+@lru_cache(maxsize=None)
+def load_taxi_zones(tolerance: float = SIMPLIFY_TOLERANCE) -> 'gpd.GeoDataFrame':
+    """
+    Taxi zones with `TAXI_ZONES_COLUMNS`, in WGS84 and simplified, read once
+    per process. The frame is shared by all callers, so it must not be
+    modified in place.
+    """
+    import geopandas as gpd
+    return gpd.read_parquet(build_taxi_zones(tolerance))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tolerance', type=float, default=SIMPLIFY_TOLERANCE,
+                        help='tolerance of the simplification, in degrees')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild the file even if it exists')
+    args = parser.parse_args()
+
+    path = build_taxi_zones(tolerance=args.tolerance, force=args.force)
+    print(f'{path} ({path.stat().st_size / 1e6:.2f} MB, '
+          f'shapefile {TAXI_ZONES_SHAPEFILE.stat().st_size / 1e6:.2f} MB)')
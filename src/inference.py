@@ -1,25 +1,11 @@
 from datetime import datetime, timedelta
+from typing import Optional
 
-import hopsworks
-from hsfs.feature_store import FeatureStore
 import pandas as pd
 import numpy as np
 
 import config as config
 
-
-def get_hopsworks_project() -> hopsworks.project.Project:
-
-    return hopsworks.login(
-        project=config.HOPSWORKS_PROJECT_NAME,
-        api_key_value=config.HOPSWORKS_API_KEY
-    )
-
-def get_feature_store() -> FeatureStore:
-
-    project = get_hopsworks_project()
-    return project.get_feature_store()
-
 def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
     """"""
     # past_rides_columns = [c for c in features.columns if c.startswith('rides_')]
@@ -31,14 +17,71 @@ def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
     
     return results
 
+def _get_serving_model(model, validation_features: pd.DataFrame):
+    """
+    `model.ServingModel` form of `model`. A pipeline is converted, and checked
+    on `validation_features`, only the first time, and its serving form kept
+    on it, so the pipelines `load_model_from_registry` keeps in memory are
+    converted once per process.
+    """
+    from model import ServingModel
+
+    if isinstance(model, ServingModel):
+        return model
+    serving_model = getattr(model, '_serving_model', None)
+    if serving_model is None:
+        serving_model = ServingModel.from_pipeline(model, validation_features=validation_features)
+        model._serving_model = serving_model
+    return serving_model
+
+def get_model_predictions_for_next_hours(
+    model,
+    features: pd.DataFrame,
+    n_hours: int = 24,
+) -> pd.DataFrame:
+    """
+    Predictions for all locations in each of the `n_hours` hours from their
+    `pickup_hour`, in one pass, with `model.ServingModel.predict_next_hours`.
+
+    One row per (pickup_hour, pickup_location_id), with the columns of
+    `get_model_predictions`, `pickup_hour` and `horizon`, the number of hours
+    ahead of the features, ready for a single insert into the forecasts
+    feature group. The first hour, `horizon == 1`, is the same as
+    `get_model_predictions`.
+    """
+    model = _get_serving_model(model, features)
+
+    pickup_hour = pd.DatetimeIndex(features['pickup_hour'])
+    predictions = model.predict_next_hours(
+        features[model.lag_columns].to_numpy(),
+        features['pickup_location_id'].to_numpy(),
+        pickup_hour,
+        n_hours,
+    )
+
+    # hour after hour, all locations in each
+    results = pd.DataFrame()
+    results['pickup_location_id'] = np.tile(features['pickup_location_id'].values, n_hours)
+    results['predicted_demand'] = predictions.T.ravel().round(0)
+    results['pickup_hour'] = pd.concat(
+        [pd.Series(pickup_hour + timedelta(hours=hour)) for hour in range(n_hours)],
+        ignore_index=True)
+    results['horizon'] = np.repeat(np.arange(1, n_hours + 1), len(features))
+
+    return results
+
 # we are loading the collection of features from store
 def load_batch_of_features_from_store(
-    current_date: pd.Timestamp,    
+    current_date: pd.Timestamp,
+    use_cache: bool = False,
 ) -> pd.DataFrame:
-    
-    #connecting to feature store
-    feature_store = get_feature_store()
+    """
+    Features to predict the rides at `current_date` for all locations.
 
+    With `use_cache`, the hours already fetched by previous calls are read
+    from a local cache in FEATURE_STORE_CACHE_DIR and only the missing ones
+    are fetched from the feature store.
+    """
     n_features = config.N_FEATURES
 
     ###
@@ -46,33 +89,97 @@ def load_batch_of_features_from_store(
     fetch_data_to = current_date - timedelta(hours=1) #current data minus 1hour
     fetch_data_from = current_date - timedelta(days=28) #from the last 28 days
     print(f'Fetching data from {fetch_data_from} to {fetch_data_to}')
-    feature_view = feature_store.get_feature_view(
-        name=config.FEATURE_VIEW_NAME,
-        version=config.FEATURE_VIEW_VERSION
-    )
 
-    ts_data = feature_view.get_batch_data(
-        start_time=fetch_data_from - timedelta(days=1),
-        end_time=fetch_data_to + timedelta(days=1)
-    )
-    ts_data = ts_data[ts_data.pickup_hour.between(fetch_data_from, fetch_data_to)]
+    # the login and the handles are shared with the rest of the process
+    if use_cache:
+        from feature_store_api import get_feature_view
+        from feature_store_cache import CachedFeatureView, ParquetCacheStorage
+        from paths import FEATURE_STORE_CACHE_DIR
+
+        # the cache fetches exactly the hours it is missing
+        feature_view = CachedFeatureView(
+            get_feature_view(name=config.FEATURE_VIEW_NAME, version=config.FEATURE_VIEW_VERSION),
+            ParquetCacheStorage(FEATURE_STORE_CACHE_DIR))
+        ts_data = feature_view.get_batch_data(
+            start_time=fetch_data_from,
+            end_time=fetch_data_to
+        )
+    else:
+        # only the hours we need are read from the store
+        from feature_store_api import read_time_range
+        ts_data = read_time_range(config.FEATURE_GROUP_METADATA, fetch_data_from, fetch_data_to)
     ###
     #now we need to transform it to vector of features
 
-    print(f'{ts_data=}')
-
+    return transform_ts_data_into_features(ts_data, current_date, n_features)
+
+def _check_ts_data_is_complete(
+    ts_data: pd.DataFrame,
+    expected_hours: pd.DatetimeIndex,
+    max_examples: int = 10,
+):
+    """
+    Raises if any location in `ts_data` has a missing or duplicated
+    `pickup_hour` among `expected_hours`, listing the first `max_examples`
+    (pickup_location_id, pickup_hour) slots of each kind.
+    """
+    slots = pd.MultiIndex.from_frame(ts_data[['pickup_location_id', 'pickup_hour']])
+
+    duplicated_slots = slots[slots.duplicated()].unique()
+    missing_slots = pd.MultiIndex.from_product(
+        [ts_data['pickup_location_id'].unique(), expected_hours],
+        names=['pickup_location_id', 'pickup_hour']
+    ).difference(slots)
+
+    if len(duplicated_slots) == 0 and len(missing_slots) == 0:
+        return
+
+    def _examples(slots: pd.MultiIndex) -> str:
+        return ', '.join(f'({location_id}, {hour})' for location_id, hour in slots[:max_examples])
+
+    message = 'Time-series data is not complete.'
+    if len(missing_slots) > 0:
+        locations = missing_slots.get_level_values('pickup_location_id').unique()
+        message += f' {len(missing_slots)} missing (pickup_location_id, pickup_hour) ' \
+            f'slots in {len(locations)} locations {list(locations[:max_examples])}, ' \
+            f'e.g. {_examples(missing_slots)}.'
+    if len(duplicated_slots) > 0:
+        message += f' {len(duplicated_slots)} duplicated slots, e.g. {_examples(duplicated_slots)}.'
+
+    raise Exception(message)
+
+def transform_ts_data_into_features(
+    ts_data: pd.DataFrame,
+    current_date: pd.Timestamp,
+    n_features: int = config.N_FEATURES,
+) -> pd.DataFrame:
+    """
+    Transposes the time-series of the `n_features` hours before `current_date`
+    into one row of features per location, sorted by `pickup_location_id`.
+
+    The data is sorted once and reshaped into a (n_locations, n_features)
+    array, after checking that no location has missing or duplicated hours.
+    """
+    expected_hours = pd.date_range(
+        current_date - timedelta(hours=n_features),
+        current_date - timedelta(hours=1),
+        freq='H'
+    )
+    ts_data = ts_data[ts_data.pickup_hour.between(expected_hours[0], expected_hours[-1])]
 
-    location_ids = ts_data['pickup_location_id'].unique()
-    assert len(ts_data) == n_features * len(location_ids),  "Time-series data is not complete."
-    
     # sort data by location and time
-    ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'], inplace=True)
+    ts_data = ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'])
+    location_ids = ts_data['pickup_location_id'].unique()
 
-    x = np.ndarray(shape=(len(location_ids), n_features), dtype=np.float32)
-    for i, location_id in enumerate(location_ids):
-        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, :]
-        ts_data_i = ts_data_i.sort_values(by=['pickup_hour'])
-        x[i, :] = ts_data_i['rides'].values
+    # once sorted, complete data has exactly the expected hours in every row
+    is_complete = len(ts_data) == n_features * len(location_ids) and (
+        ts_data['pickup_hour'].values.reshape(len(location_ids), n_features)
+        == expected_hours.values
+    ).all()
+    if not is_complete:
+        _check_ts_data_is_complete(ts_data, expected_hours)
+
+    x = ts_data['rides'].to_numpy(dtype=np.float32).reshape(len(location_ids), n_features)
 
     # numpy arrays to Pandas dataframes
     features = pd.DataFrame(
@@ -81,58 +188,44 @@ def load_batch_of_features_from_store(
     )
     features['pickup_hour'] = current_date
     features['pickup_location_id'] = location_ids
-    features.sort_values(by=['pickup_location_id'], inplace=True)
 
     return features
-    
-def load_model_from_registry():
-    
-    import joblib
-    from pathlib import Path
 
-    project = get_hopsworks_project()
-    model_registry = project.get_model_registry()
+def load_model_from_registry(model_registry=None, mmap_mode: Optional[str] = None):
+    """
+    Loads the production model, from memory or the local copy in
+    MODEL_CACHE_DIR when available, and from the model registry otherwise.
+
+    Pass `model_registry` to use something else than the Hopsworks model
+    registry, e.g. a stand-in with the same `get_model(name, version)`
+    method in offline tests.
+    """
+    from model_cache import load_model
+    from feature_store_api import get_model_registry
 
-    model = model_registry.get_model(
+    return load_model(
         name=config.MODEL_NAME,
         version=config.MODEL_VERSION,
-    )  
-    
-    model_dir = model.download()
-    model = joblib.load(Path(model_dir)  / 'model.pkl')
-       
-    return model
+        get_model_registry=get_model_registry if model_registry is None else lambda: model_registry,
+        mmap_mode=mmap_mode,
+    )
 
 def load_predictions_from_store(
     from_pickup_hour: datetime,
     to_pickup_hour: datetime
     ) -> pd.DataFrame:
 
-    from config import FEATURE_VIEW_PREDICTIONS_METADATA
-    from feature_store_api import get_or_create_feature_view
-
-    print(from_pickup_hour)
-    print(to_pickup_hour)
-
-    # get pointer to the feature view
-    predictions_fv = get_or_create_feature_view(FEATURE_VIEW_PREDICTIONS_METADATA)
+    from config import FEATURE_GROUP_PREDICTIONS_METADATA
+    from feature_store_api import read_time_range
 
-    # get data from the feature view
+    # get exactly the predictions in the range
     print(f'Fetching predictions for `pickup_hours` between {from_pickup_hour}  and {to_pickup_hour}')
-    predictions = predictions_fv.get_batch_data(
-        start_time=from_pickup_hour - timedelta(days=1),
-        end_time=to_pickup_hour + timedelta(days=1)
-    )
-    
+    predictions = read_time_range(FEATURE_GROUP_PREDICTIONS_METADATA, from_pickup_hour, to_pickup_hour)
+
     # make sure datetimes are UTC aware
     predictions['pickup_hour'] = pd.to_datetime(predictions['pickup_hour'], utc=True)
-    from_pickup_hour = pd.to_datetime(from_pickup_hour, utc=True)
-    to_pickup_hour = pd.to_datetime(to_pickup_hour, utc=True)
-
-    # make sure we keep only the range we want
-    predictions = predictions[predictions.pickup_hour.between(from_pickup_hour, to_pickup_hour)]
 
     # sort by `pick_up_hour` and `pickup_location_id`
     predictions.sort_values(by=['pickup_hour', 'pickup_location_id'], inplace=True)
 
-    return predictions
\ No newline at end of file
+    return predictions
@@ -0,0 +1,80 @@
+"""
+Inference pipeline, from notebook 14: predicts the rides of the current hour
+for all locations, or of the next hours, and stores the predictions in the
+feature store.
+
+    python src/inference_pipeline.py [--current-date 2023-02-28T09:00] [--n-hours 24]
+"""
+import argparse
+from datetime import datetime
+from typing import Optional
+
+from timing import StageTimer
+
+
+def run(
+    current_date: Optional[datetime] = None,
+    n_hours: int = 1,
+    wait_for_job: bool = False,
+):
+    """
+    Predicts the rides at `current_date`, by default the current hour, and in
+    the `n_hours - 1` hours after it, and writes the new or changed
+    predictions of `current_date` into the predictions feature group.
+
+    The predictions of all `n_hours` hours go into the forecasts feature
+    group, with their `horizon`, so the predictions feature group only holds
+    1 hour ahead predictions, the ones monitoring compares with the rides.
+    """
+    import pandas as pd
+
+    timer = StageTimer('inference pipeline')
+
+    if current_date is None:
+        current_date = datetime.utcnow()
+    current_date = pd.to_datetime(current_date).floor('H')
+    print(f'{current_date=}')
+
+    with timer.stage('load features'):
+        from inference import load_batch_of_features_from_store
+        features = load_batch_of_features_from_store(current_date)
+
+    with timer.stage('load model'):
+        from inference import load_model_from_registry
+        model = load_model_from_registry()
+
+    with timer.stage('predict'):
+        if n_hours == 1:
+            from inference import get_model_predictions
+            predictions = get_model_predictions(model, features)
+            predictions['pickup_hour'] = current_date
+        else:
+            from inference import get_model_predictions_for_next_hours
+            forecasts = get_model_predictions_for_next_hours(model, features, n_hours)
+            predictions = forecasts[forecasts['horizon'] == 1].drop(columns='horizon')
+
+    with timer.stage('insert into feature group'):
+        import config as config
+        from feature_store_api import upsert_features
+        upsert_features(config.FEATURE_GROUP_PREDICTIONS_METADATA, predictions,
+                        wait_for_job=wait_for_job)
+        if n_hours > 1:
+            upsert_features(config.FEATURE_GROUP_FORECASTS_METADATA, forecasts,
+                            wait_for_job=wait_for_job)
+
+    timer.report()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--current-date', type=datetime.fromisoformat, default=None,
+                        help='UTC hour to predict, by default the current one')
+    parser.add_argument('--n-hours', type=int, default=1,
+                        help='number of hours to predict from the current one')
+    parser.add_argument('--wait-for-job', action='store_true',
+                        help='wait for the Hopsworks materialization job to finish')
+    args = parser.parse_args()
+
+    run(current_date=args.current_date, n_hours=args.n_hours, wait_for_job=args.wait_for_job)
@@ -0,0 +1,405 @@
+"""
+Local stand-in for the Hopsworks feature store, to run and profile the
+pipelines on one machine, without a Hopsworks project.
+
+It implements the part of the `hsfs` API this project uses, so the rest of
+the code does not know which one it talks to. Select it with the
+environment variable (or `.env` entry)
+
+    FEATURE_STORE_BACKEND=local
+
+and `feature_store_api.get_feature_store` returns a `LocalFeatureStore` in
+LOCAL_FEATURE_STORE_DIR instead of logging in to Hopsworks.
+
+Every feature group is a directory of parquet files, one per day of its
+`event_time`, and every feature view a JSON file with its query.
+"""
+import json
+import operator
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+def _to_naive_utc(value) -> pd.Timestamp:
+    """
+    Event times are stored as naive UTC datetimes. Naive datetimes are
+    assumed to be in UTC already, and integers are unix times in
+    milliseconds, like the ones Hopsworks filters take.
+    """
+    if isinstance(value, (int, float)):
+        return pd.Timestamp(value, unit='ms')
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert('UTC').tz_localize(None)
+    return value
+
+
+_OPERATORS = {
+    '>=': operator.ge,
+    '>': operator.gt,
+    '<=': operator.le,
+    '<': operator.lt,
+    '==': operator.eq,
+    '!=': operator.ne,
+    'isin': lambda values, allowed: values.isin(allowed),
+}
+
+
+class LocalFeature:
+    """A column of a feature group, e.g. `feature_group.pickup_hour`, to build filters"""
+
+    def __init__(self, feature_group: 'LocalFeatureGroup', name: str):
+        self.feature_group = feature_group
+        self.name = name
+
+    def _condition(self, op: str, value) -> 'LocalCondition':
+        return LocalCondition(self, op, value)
+
+    def __ge__(self, value): return self._condition('>=', value)
+    def __gt__(self, value): return self._condition('>', value)
+    def __le__(self, value): return self._condition('<=', value)
+    def __lt__(self, value): return self._condition('<', value)
+    def __eq__(self, value): return self._condition('==', value)
+    def __ne__(self, value): return self._condition('!=', value)
+
+    def isin(self, values: List) -> 'LocalCondition':
+        return self._condition('isin', list(values))
+
+    __hash__ = object.__hash__
+
+
+class LocalCondition:
+    """`feature <op> value`, applied with `LocalQuery.filter`"""
+
+    def __init__(self, feature: LocalFeature, op: str, value):
+        self.feature = feature
+        self.op = op
+        # comparisons with the event time accept datetimes and milliseconds
+        if feature.name == feature.feature_group.event_time and op != 'isin':
+            value = _to_naive_utc(value)
+        self.value = value
+
+    def expression(self) -> ds.Expression:
+        if self.op == 'isin':
+            return ds.field(self.feature.name).isin(self.value)
+        value = self.value.to_pydatetime() if isinstance(self.value, pd.Timestamp) else self.value
+        return _OPERATORS[self.op](ds.field(self.feature.name), pa.scalar(value))
+
+    def to_dict(self) -> Dict:
+        value = self.value
+        if isinstance(value, pd.Timestamp):
+            value = {'timestamp': value.isoformat()}
+        return {'feature_group': self.feature.feature_group.key, 'feature': self.feature.name,
+                'op': self.op, 'value': value}
+
+    @classmethod
+    def from_dict(cls, store: 'LocalFeatureStore', spec: Dict) -> 'LocalCondition':
+        feature_group = store.get_feature_group(*spec['feature_group'])
+        value = spec['value']
+        if isinstance(value, dict):
+            value = pd.Timestamp(value['timestamp'])
+        return cls(LocalFeature(feature_group, spec['feature']), spec['op'], value)
+
+
+class LocalQuery:
+    """
+    Columns of a feature group, optionally inner-joined with other queries
+    and filtered, like `hsfs.constructor.query.Query`
+    """
+    def __init__(
+        self,
+        feature_group: 'LocalFeatureGroup',
+        features: Optional[List[str]] = None,
+        joins: Optional[List[Tuple['LocalQuery', List[str], Optional[str]]]] = None,
+        conditions: Optional[List[LocalCondition]] = None,
+    ):
+        self.feature_group = feature_group
+        self.features = features
+        self.joins = joins or []
+        self.conditions = conditions or []
+
+    def join(self, query: 'LocalQuery', on: List[str], prefix: Optional[str] = None) -> 'LocalQuery':
+        return LocalQuery(self.feature_group, self.features,
+                          self.joins + [(query, list(on), prefix)], self.conditions)
+
+    def filter(self, condition: LocalCondition) -> 'LocalQuery':
+        return LocalQuery(self.feature_group, self.features, self.joins,
+                          self.conditions + [condition])
+
+    def read(self, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None,
+             **kwargs) -> pd.DataFrame:
+        """
+        Rows with `start_time <= event_time < end_time`, if given. The time
+        range and the filters are pushed down to the parquet scans, and so is
+        the time range to joined queries whose event time is a join key.
+        """
+        own_conditions = [c for c in self.conditions
+                          if c.feature.feature_group.key == self.feature_group.key]
+        data = self.feature_group._scan(start_time, end_time, own_conditions, self.features)
+
+        for query, on, prefix in self.joins:
+            join_on_time = query.feature_group.event_time in on and \
+                self.feature_group.event_time in on
+            other = query.read(start_time, end_time) if join_on_time else query.read()
+            if prefix:
+                other = other.rename(columns={c: prefix + c for c in other.columns if c not in on})
+            data = data.merge(other, on=on, how='inner')
+
+        # filters on the columns of the joined feature groups
+        for condition in self.conditions:
+            if condition not in own_conditions:
+                data = data[_OPERATORS[condition.op](data[condition.feature.name], condition.value)]
+        return data
+
+    def to_dict(self) -> Dict:
+        return {
+            'feature_group': self.feature_group.key,
+            'features': self.features,
+            'joins': [{'query': query.to_dict(), 'on': on, 'prefix': prefix}
+                      for query, on, prefix in self.joins],
+            'conditions': [condition.to_dict() for condition in self.conditions],
+        }
+
+    @classmethod
+    def from_dict(cls, store: 'LocalFeatureStore', spec: Dict) -> 'LocalQuery':
+        return cls(
+            store.get_feature_group(*spec['feature_group']),
+            spec['features'],
+            [(cls.from_dict(store, join['query']), join['on'], join['prefix'])
+             for join in spec['joins']],
+            [LocalCondition.from_dict(store, condition) for condition in spec['conditions']],
+        )
+
+
+class LocalFeatureGroup:
+    """
+    Feature group stored as one parquet file per day of `event_time`,
+    `<directory>/date=YYYY-MM-DD.parquet`.
+
+    `insert` upserts on the primary key, which must hold the event time, so
+    each key lives in a single file and only the days of the inserted rows
+    are rewritten.
+    """
+    def __init__(
+        self,
+        directory: Path,
+        name: str,
+        version: int,
+        primary_key: List[str],
+        event_time: str,
+        description: str = '',
+        online_enabled: bool = False,
+    ):
+        if event_time not in primary_key:
+            raise Exception(f'The primary key {primary_key} of the local feature group {name} '
+                            f'must include its event time {event_time}')
+        self.directory = Path(directory)
+        self.name = name
+        self.version = version
+        self.primary_key = list(primary_key)
+        self.event_time = event_time
+        self.description = description
+        self.online_enabled = online_enabled
+
+    def __getattr__(self, name: str) -> LocalFeature:
+        # feature_group.pickup_hour >= ..., like hsfs
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return LocalFeature(self, name)
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        return self.name, self.version
+
+    @property
+    def id(self) -> Optional[int]:
+        """None until the first insert, like the unsaved feature groups of hsfs"""
+        return self.version if self._days() else None
+
+    def _path(self, day: pd.Timestamp) -> Path:
+        return self.directory / f'date={day:%Y-%m-%d}.parquet'
+
+    def _days(self) -> List[pd.Timestamp]:
+        return sorted(pd.Timestamp(path.stem.split('=')[1])
+                      for path in self.directory.glob('date=*.parquet'))
+
+    def _scan(
+        self,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        conditions: Optional[List[LocalCondition]] = None,
+        features: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """Rows in the time range that pass all `conditions`, reading only the days in range"""
+        conditions = list(conditions or [])
+        if start_time is not None:
+            conditions.append(LocalCondition(LocalFeature(self, self.event_time), '>=', start_time))
+        if end_time is not None:
+            conditions.append(LocalCondition(LocalFeature(self, self.event_time), '<', end_time))
+
+        # days that may hold rows within the bounds on the event time
+        first_day, last_day = pd.Timestamp.min, pd.Timestamp.max
+        for condition in conditions:
+            if condition.feature.name != self.event_time:
+                continue
+            if condition.op in ('>=', '>', '=='):
+                first_day = max(first_day, condition.value.floor('D'))
+            if condition.op in ('<=', '<', '=='):
+                last_day = min(last_day, condition.value.floor('D'))
+        days = self._days()
+        paths = [str(self._path(day)) for day in days if first_day <= day <= last_day]
+        if not paths:
+            if not days:
+                # nothing stored yet, only the columns we know of
+                return pd.DataFrame(columns=features or self.primary_key)
+            # no rows in range, but the columns and dtypes of the stored ones
+            schema = ds.dataset(str(self._path(days[0])), format='parquet').schema
+            return schema.empty_table().select(features or schema.names).to_pandas()
+
+        expression = None
+        for condition in conditions:
+            expression = condition.expression() if expression is None \
+                else expression & condition.expression()
+        table = ds.dataset(paths, format='parquet').to_table(columns=features, filter=expression)
+        return table.to_pandas()
+
+    def read(self, **kwargs) -> pd.DataFrame:
+        return self._scan()
+
+    def select_all(self) -> LocalQuery:
+        return LocalQuery(self)
+
+    def select(self, features: List[str]) -> LocalQuery:
+        return LocalQuery(self, list(features))
+
+    def insert(self, features: pd.DataFrame, write_options: Optional[Dict] = None, **kwargs):
+        """
+        Upserts `features`: rows with the primary key of a stored row replace
+        it, the others are appended. There is no materialization job, so
+        `write_options` are ignored.
+        """
+        features = features.copy()
+        event_time = pd.to_datetime(features[self.event_time])
+        if event_time.dt.tz is not None:
+            event_time = event_time.dt.tz_convert('UTC').dt.tz_localize(None)
+        features[self.event_time] = event_time
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for day, new_rows in features.groupby(event_time.dt.floor('D').values):
+            path = self._path(pd.Timestamp(day))
+            if path.exists():
+                stored_rows = pd.read_parquet(path)
+                new_rows = pd.concat([stored_rows, new_rows.astype(stored_rows.dtypes.to_dict())],
+                                     ignore_index=True)
+            new_rows = new_rows \
+                .drop_duplicates(subset=self.primary_key, keep='last') \
+                .sort_values(by=[self.event_time] + self.primary_key)
+
+            # write and rename, so readers never see a half written file
+            tmp_path = path.with_name(path.name + '.tmp')
+            new_rows.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'version': self.version, 'primary_key': self.primary_key,
+                'event_time': self.event_time, 'description': self.description,
+                'online_enabled': self.online_enabled}
+
+
+class LocalFeatureView:
+    """Saved query over local feature groups, like `hsfs.feature_view.FeatureView`"""
+
+    def __init__(self, name: str, version: int, query: LocalQuery):
+        self.name = name
+        self.version = version
+        self.query = query
+
+    def get_batch_data(self, start_time: Optional[datetime] = None,
+                       end_time: Optional[datetime] = None, **kwargs) -> pd.DataFrame:
+        """Rows with `start_time <= event_time < end_time`"""
+        return self.query.read(start_time, end_time)
+
+    def training_data(self, **kwargs) -> Tuple[pd.DataFrame, None]:
+        """All rows, and no labels"""
+        return self.query.read(), None
+
+
+class LocalFeatureStore:
+    """
+    Feature groups and views in `directory`, with the methods of
+    `hsfs.feature_store.FeatureStore` that `feature_store_api` calls
+    """
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def _feature_group_dir(self, name: str, version: int) -> Path:
+        return self.directory / 'feature_groups' / f'{name}_{version}'
+
+    def _feature_view_path(self, name: str, version: int) -> Path:
+        return self.directory / 'feature_views' / f'{name}_{version}.json'
+
+    def get_feature_group(self, name: str, version: int = 1) -> LocalFeatureGroup:
+        directory = self._feature_group_dir(name, version)
+        metadata_path = directory / '_metadata.json'
+        if not metadata_path.exists():
+            raise Exception(f'Feature group {name} version {version} does not exist')
+        return LocalFeatureGroup(directory, **json.loads(metadata_path.read_text()))
+
+    def get_or_create_feature_group(
+        self,
+        name: str,
+        version: int,
+        primary_key: List[str],
+        event_time: str,
+        description: str = '',
+        online_enabled: bool = False,
+        **kwargs
+    ) -> LocalFeatureGroup:
+        directory = self._feature_group_dir(name, version)
+        if (directory / '_metadata.json').exists():
+            return self.get_feature_group(name, version)
+
+        feature_group = LocalFeatureGroup(directory, name, version, primary_key, event_time,
+                                          description, online_enabled)
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / '_metadata.json').write_text(json.dumps(feature_group.to_dict()))
+        return feature_group
+
+    def get_feature_view(self, name: str, version: int = 1) -> LocalFeatureView:
+        path = self._feature_view_path(name, version)
+        if not path.exists():
+            raise Exception(f'Feature view {name} version {version} does not exist')
+        return LocalFeatureView(name, version,
+                                LocalQuery.from_dict(self, json.loads(path.read_text())))
+
+    def create_feature_view(self, name: str, version: int, query: LocalQuery,
+                            **kwargs) -> LocalFeatureView:
+        path = self._feature_view_path(name, version)
+        if path.exists():
+            raise Exception(f'Feature view {name} version {version} already exists')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(query.to_dict()))
+        return LocalFeatureView(name, version, query)
+
+
+class LocalModelRegistry:
+    """
+    Serves `models/model.pkl`, the model saved by the training pipeline, as
+    every model name and version, for `inference.load_model_from_registry`
+    """
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    def get_model(self, name: str, version: int = 1) -> 'LocalModelRegistry':
+        if not (self.directory / 'model.pkl').exists():
+            raise Exception(f'No model.pkl in {self.directory}, run the training pipeline first')
+        return self
+
+    def download(self) -> str:
+        return str(self.directory)
@@ -0,0 +1,134 @@
+"""
+Error metrics of the predictions against the actual rides, for the
+monitoring dashboard and batch jobs.
+
+All metrics are computed from additive sums of errors per group, so the
+(pickup_hour, pickup_location_id) sums are computed once and the other
+groupings and the rolling windows only add them up.
+"""
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+METRICS = ['mae', 'rmse', 'bias', 'mape']
+
+# sums every metric is computed from, as stored in the monitoring rollup
+SUM_COLUMNS = ['n', 'abs_error', 'squared_error', 'error', 'n_nonzero', 'abs_percentage_error',
+               'rides']
+
+
+def get_error_sums(
+    monitoring_df: pd.DataFrame,
+    by: Union[str, List[str]] = ('pickup_hour', 'pickup_location_id'),
+    actual: str = 'rides',
+    predicted: str = 'predicted_demand',
+) -> pd.DataFrame:
+    """
+    Sums of errors per group of `by`, in one vectorized pass over the rows of
+    `monitoring_df`, e.g. the output of
+    `monitoring.load_predictions_and_actual_values_from_store`.
+    """
+    actual_values = monitoring_df[actual].to_numpy(dtype=np.float64)
+    error = monitoring_df[predicted].to_numpy(dtype=np.float64) - actual_values
+    abs_error = np.abs(error)
+    is_nonzero = actual_values != 0
+
+    errors = pd.DataFrame({
+        'n': np.ones(len(error)),
+        'abs_error': abs_error,
+        'squared_error': error ** 2,
+        'error': error,
+        # percentage errors are only defined for hours with rides
+        'n_nonzero': is_nonzero.astype(np.float64),
+        'abs_percentage_error': np.divide(abs_error, actual_values, out=np.zeros_like(abs_error),
+                                          where=is_nonzero),
+        'rides': actual_values,
+    })
+    by = [by] if isinstance(by, str) else list(by)
+    # grouped by the columns themselves, not their values, to keep their
+    # dtypes, e.g. the UTC timezone of pickup_hour
+    return errors.groupby([monitoring_df[column].reset_index(drop=True) for column in by]).sum() \
+        .rename_axis(by)
+
+
+def get_metrics_from_sums(sums: pd.DataFrame) -> pd.DataFrame:
+    """
+    MAE, RMSE, bias (mean of prediction - actual) and MAPE (as a fraction,
+    over the rows with rides) from the output of `get_error_sums`, with the
+    number of rows `n` and the total actual `rides`
+    """
+    n = sums['n'].where(sums['n'] > 0)
+    metrics = pd.DataFrame(index=sums.index)
+    metrics['mae'] = sums['abs_error'] / n
+    metrics['rmse'] = np.sqrt(sums['squared_error'] / n)
+    metrics['bias'] = sums['error'] / n
+    metrics['mape'] = sums['abs_percentage_error'] / sums['n_nonzero'].where(sums['n_nonzero'] > 0)
+    metrics['n'] = sums['n'].astype(int)
+    metrics['rides'] = sums['rides']
+    return metrics
+
+
+def compute_metrics_from_sums(sums: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    `METRICS` per 'hour', per 'location' and per 'hour_location' from the
+    `get_error_sums` per (pickup_hour, pickup_location_id), e.g. the ones of
+    `monitoring.load_locations_monitoring_rollup_from_store`. Each frame is
+    indexed by its group.
+    """
+    return {
+        'hour': get_metrics_from_sums(sums.groupby(level='pickup_hour').sum()),
+        'location': get_metrics_from_sums(sums.groupby(level='pickup_location_id').sum()),
+        'hour_location': get_metrics_from_sums(sums),
+    }
+
+
+def compute_metrics(
+    monitoring_df: pd.DataFrame,
+    actual: str = 'rides',
+    predicted: str = 'predicted_demand',
+) -> Dict[str, pd.DataFrame]:
+    """`compute_metrics_from_sums`, from a single pass over `monitoring_df`"""
+    return compute_metrics_from_sums(
+        get_error_sums(monitoring_df, ['pickup_hour', 'pickup_location_id'], actual, predicted))
+
+
+def compute_rolling_metrics_from_sums(
+    sums: pd.DataFrame,
+    window_hours: int = 24,
+    per_location: bool = False,
+) -> pd.DataFrame:
+    """
+    `METRICS` over the `window_hours` hours up to every `pickup_hour`, of all
+    locations together or of each location with `per_location`, from the
+    `get_error_sums` per (pickup_hour, pickup_location_id). Hours without
+    rows count as empty, so the windows span the same time everywhere.
+    """
+    sums = sums[SUM_COLUMNS]
+    if per_location:
+        # (hours x locations) table of every sum, rolled along the hours at once
+        table = sums.unstack('pickup_location_id', fill_value=0)
+    else:
+        table = sums.groupby(level='pickup_hour').sum()
+
+    hours = table.index
+    table = table.reindex(pd.date_range(hours.min(), hours.max(), freq='H', name='pickup_hour'),
+                          fill_value=0)
+    rolling_sums = table.rolling(window_hours, min_periods=1).sum()
+
+    if per_location:
+        rolling_sums = rolling_sums.stack('pickup_location_id')
+    return get_metrics_from_sums(rolling_sums[SUM_COLUMNS])
+
+
+def compute_rolling_metrics(
+    monitoring_df: pd.DataFrame,
+    window_hours: int = 24,
+    per_location: bool = False,
+    actual: str = 'rides',
+    predicted: str = 'predicted_demand',
+) -> pd.DataFrame:
+    """`compute_rolling_metrics_from_sums`, from a single pass over `monitoring_df`"""
+    return compute_rolling_metrics_from_sums(
+        get_error_sums(monitoring_df, ['pickup_hour', 'pickup_location_id'], actual, predicted),
+        window_hours, per_location)
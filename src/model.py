@@ -1,59 +1,329 @@
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import numpy as np
 import pandas as pd
-from sklearn.preprocessing import FunctionTransformer
-from sklearn.base import BaseEstimator, TransformerMixin
-from sklearn.pipeline import make_pipeline, Pipeline
 
-import lightgbm as lgb
+# LightGBM and scikit-learn are imported when they are used, so importing
+# this module stays fast. The scikit-learn transformers are in
+# `feature_engineering`.
+if TYPE_CHECKING:
+    import lightgbm as lgb
+    from sklearn.pipeline import Pipeline
+
+    from data import WindowedFeatures
+
+def last_n_weeks_same_hour(n_weeks: int) -> List[int]:
+    """Lags, in hours, of the same hour in each of the last `n_weeks` weeks"""
+    return [(i + 1)*7*24 for i in range(n_weeks)]
+
+def last_n_days_same_hour(n_days: int) -> List[int]:
+    """Lags, in hours, of the same hour in each of the last `n_days` days"""
+    return [(i + 1)*24 for i in range(n_days)]
+
+# name of each lag-average column -> lags, in hours, it averages
+DEFAULT_LAG_AVERAGES = {
+    'average_rides_last_4_weeks': last_n_weeks_same_hour(4),
+}
+
+def __getattr__(name: str):
+    # the pickled pipelines reference the transformers as `model.<name>`
+    if name in ('FeaturesEngineer', 'TemporalFeaturesEngineer'):
+        import feature_engineering
+        return getattr(feature_engineering, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 def average_rides_last_4_weeks(x: pd.DataFrame) -> pd.DataFrame:
     """
-    Adds one column with the average rides from
+    Returns `x` with one more column with the average rides from
     - 7 days ago
     - 14 days ago
     - 21 days ago
     - 28 days ago
+
+    Kept for the pipelines pickled before `FeaturesEngineer`. `x` itself is
+    not modified.
     """
-    x['average_rides_last_4_weeks'] = 0.25*(
+    average_rides = 0.25*(
         x[f'rides_previous_{7*24}_hour'] + \
         x[f'rides_previous_{2*7*24}_hour'] + \
         x[f'rides_previous_{3*7*24}_hour'] + \
         x[f'rides_previous_{4*7*24}_hour']
     )
-    return x
+    return pd.concat([x, average_rides.rename('average_rides_last_4_weeks')],
+                     axis=1, copy=False)
 
 
-class TemporalFeaturesEngineer(BaseEstimator, TransformerMixin):
+def get_model_input_columns(
+    input_seq_len: int,
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+) -> List[str]:
     """
-    Scikit-learn data transformation that adds 2 columns
-    - hour
-    - day_of_week
-    and removes the `pickup_hour` datetime column.
+    Columns the LightGBM step of `get_pipeline` is trained on, in order
     """
-    def fit(self, x, y=None):
-        return self
-    
-    def transform(self, x, y=None):
-        
-        x_ = x.copy()
-        
-        # Generate numeric columns from datetime
-        x_["hour"] = x_['pickup_hour'].dt.hour
-        x_["day_of_week"] = x_['pickup_hour'].dt.dayofweek
-        
-        return x_.drop(columns=['pickup_hour'])
+    lag_averages = DEFAULT_LAG_AVERAGES if lag_averages is None else lag_averages
+    return [f'rides_previous_{i+1}_hour' for i in reversed(range(input_seq_len))] + \
+        ['pickup_location_id'] + list(lag_averages) + ['hour', 'day_of_week']
 
-def get_pipeline(**hyperparams) -> Pipeline:
+def get_model_input(
+    lags: np.ndarray,
+    pickup_location_id: np.ndarray,
+    pickup_hour,
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+    dtype=None,
+) -> np.ndarray:
+    """
+    Model input matrix, with the `get_model_input_columns`, from a
+    (n_rows, n_lags) matrix of past rides, oldest hour first like the
+    `rides_previous_*_hour` columns. `pickup_hour` is one datetime for all
+    rows or one per row.
+
+    The lags are copied once, into a matrix of `dtype`, by default the one of
+    `lags` if it is a float type and float64 otherwise, so the lag averages
+    of integer rides are not truncated, like pandas' means on the feature
+    frames.
+    """
+    lag_averages = DEFAULT_LAG_AVERAGES if lag_averages is None else lag_averages
+    n_rows, n_lags = lags.shape
+
+    if isinstance(pickup_hour, datetime):
+        pickup_hour = pd.Timestamp(pickup_hour)
+    else:
+        pickup_hour = pd.DatetimeIndex(pickup_hour)
+
+    x = np.empty((n_rows, n_lags + len(lag_averages) + 3),
+                 dtype=dtype or np.result_type(lags.dtype, np.float32))
+    x[:, :n_lags] = lags
+    x[:, n_lags] = pickup_location_id
+
+    for j, (name, lag_hours) in enumerate(lag_averages.items(), start=n_lags + 1):
+        if not lag_hours or max(lag_hours) > n_lags:
+            raise Exception(f'Cannot compute {name} from lags {lag_hours} '
+                            f'with {n_lags} past hours')
+        total = lags[:, n_lags - lag_hours[0]].copy()
+        for lag in lag_hours[1:]:
+            total += lags[:, n_lags - lag]
+        x[:, j] = total / len(lag_hours)
+
+    x[:, -2] = pickup_hour.hour
+    x[:, -1] = pickup_hour.dayofweek
+    return x
+
+
+def get_pipeline(
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+    **hyperparams
+) -> 'Pipeline':
+    """
+    Feature engineering and LightGBM model, e.g. with the same-hour rides of
+    yesterday and the last 4 weeks averaged in two extra columns
+
+        get_pipeline(lag_averages={
+            'rides_same_hour_yesterday': last_n_days_same_hour(1),
+            'average_rides_last_4_weeks': last_n_weeks_same_hour(4),
+        })
+
+    `lag_averages` defaults to `DEFAULT_LAG_AVERAGES`.
+    """
+    import lightgbm as lgb
+    from sklearn.pipeline import make_pipeline
+    from feature_engineering import FeaturesEngineer
 
     # sklearn transform
-    add_feature_average_rides_last_4_weeks = FunctionTransformer(
-        average_rides_last_4_weeks, validate=False)
-    
-    # sklearn transform
-    add_temporal_features = TemporalFeaturesEngineer()
+    add_features = FeaturesEngineer(lag_averages)
 
     # sklearn pipeline
     return make_pipeline(
-        add_feature_average_rides_last_4_weeks,
-        add_temporal_features,
+        add_features,
         lgb.LGBMRegressor(**hyperparams)
-    )
\ No newline at end of file
+    )
+
+class _WindowedFeaturesSequence:
+    """
+    Feeds `WindowedFeatures` to LightGBM one batch at a time, adding the same
+    columns as the `FeaturesEngineer` step of `get_pipeline`. It is registered
+    as a `lightgbm.Sequence` by `get_lgb_dataset`.
+    """
+    def __init__(
+        self,
+        features: 'WindowedFeatures',
+        batch_size: int,
+        lag_averages: Optional[Dict[str, List[int]]] = None,
+    ):
+        self.features = features
+        self.batch_size = batch_size
+        self.lag_averages = lag_averages
+
+    def __len__(self) -> int:
+        return len(self.features)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self._get_batch([idx])[0]
+        return self._get_batch(idx)
+
+    def _get_batch(self, rows) -> np.ndarray:
+        # LightGBM only samples rows from float64 sequences
+        return get_model_input(
+            self.features.to_numpy(rows),
+            self.features.pickup_location_id[rows],
+            self.features.pickup_hour.iloc[rows],
+            self.lag_averages,
+            dtype=np.float64,
+        )
+
+def get_lgb_dataset(
+    features: 'WindowedFeatures',
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+    batch_size: int = 4096,
+    **params
+) -> 'lgb.Dataset':
+    """
+    LightGBM Dataset built from `features` without materializing the full
+    feature matrix: LightGBM reads one batch of `batch_size` rows at a time and
+    only keeps the binned values. Train on it with `lgb.train(params, dataset)`.
+    """
+    import lightgbm as lgb
+    lgb.Sequence.register(_WindowedFeaturesSequence)
+
+    return lgb.Dataset(
+        _WindowedFeaturesSequence(features, batch_size, lag_averages),
+        label=features.targets,
+        feature_name=get_model_input_columns(features.input_seq_len, lag_averages),
+        params=params or None,
+    )
+
+class ServingModel:
+    """
+    Serving form of a pipeline trained with `get_pipeline`. It computes the
+    columns added by the transformation steps directly on a NumPy matrix and
+    calls the native `predict` of the LightGBM booster, so no pandas frames
+    are built or copied per batch.
+
+    Build it with `ServingModel.from_pipeline`, and use it wherever the
+    pipeline was used, e.g. `inference.get_model_predictions(model, features)`.
+    """
+    def __init__(
+        self,
+        booster: 'lgb.Booster',
+        lag_averages: Optional[Dict[str, List[int]]] = None,
+    ):
+        self.booster = booster
+        self.lag_averages = lag_averages
+        self.feature_names = booster.feature_name()
+        self.lag_columns = [c for c in self.feature_names if c.startswith('rides_previous_')]
+        self.n_lags = len(self.lag_columns)
+
+        if self.feature_names != get_model_input_columns(self.n_lags, lag_averages):
+            raise Exception(f'Unexpected model input columns {self.feature_names[self.n_lags:]}, '
+                            f'expected the ones of `get_model_input_columns`.')
+
+    @classmethod
+    def from_pipeline(
+        cls,
+        pipeline: 'Pipeline',
+        validation_features: Optional[pd.DataFrame] = None,
+    ) -> 'ServingModel':
+        """
+        Serving form of `pipeline`, which must have the steps of `get_pipeline`,
+        or the ones it had before `FeaturesEngineer`.
+
+        If `validation_features` are given, the predictions of both forms on
+        them are checked to be bit-identical.
+        """
+        import lightgbm as lgb
+        from sklearn.preprocessing import FunctionTransformer
+        from feature_engineering import FeaturesEngineer, TemporalFeaturesEngineer
+
+        steps = [step for _, step in pipeline.steps]
+        is_current = len(steps) == 2 and isinstance(steps[0], FeaturesEngineer)
+        is_legacy = (
+            len(steps) == 3
+            and isinstance(steps[0], FunctionTransformer)
+            and getattr(steps[0].func, '__name__', None) == average_rides_last_4_weeks.__name__
+            and isinstance(steps[1], TemporalFeaturesEngineer)
+        )
+        if not (is_current or is_legacy) or not isinstance(steps[-1], lgb.LGBMRegressor):
+            raise Exception(f'Cannot export pipeline with steps {[type(s).__name__ for s in steps]}, '
+                            f'only the ones of `get_pipeline` are supported.')
+        lag_averages = steps[0].lag_averages if is_current else DEFAULT_LAG_AVERAGES
+
+        model = cls(steps[-1].booster_, lag_averages)
+
+        if validation_features is not None:
+            expected = pipeline.predict(validation_features)
+            predictions = model.predict(validation_features)
+            if not np.array_equal(expected, predictions):
+                n_diff = int((expected != predictions).sum())
+                raise Exception(f'Serving model predictions differ from the pipeline ones '
+                                f'in {n_diff} of {len(expected)} rows.')
+
+        return model
+
+    def predict_array(
+        self,
+        lags: np.ndarray,
+        pickup_location_id: np.ndarray,
+        pickup_hour,
+    ) -> np.ndarray:
+        """
+        Predictions for a (n_rows, n_lags) matrix of past rides, oldest hour
+        first, like the `rides_previous_*_hour` columns.
+
+        `pickup_hour` is one datetime for all rows or one per row. The derived
+        columns are computed in the dtype of `lags`, as pandas does in the
+        pipeline, so float32 lags give the same predictions as the pipeline.
+        """
+        if lags.shape[1] != self.n_lags:
+            raise Exception(f'Expected {self.n_lags} lags, got {lags.shape[1]}')
+
+        return self.booster.predict(
+            get_model_input(lags, pickup_location_id, pickup_hour, self.lag_averages))
+
+    def predict_next_hours(
+        self,
+        lags: np.ndarray,
+        pickup_location_id: np.ndarray,
+        pickup_hour,
+        n_hours: int,
+    ) -> np.ndarray:
+        """
+        (n_rows, n_hours) predictions for each of the `n_hours` hours from
+        `pickup_hour`, by recursive rollout: every hour is predicted from the
+        lags of the previous one shifted by one hour, with its prediction as
+        the newest lag. The first hour is the same as `predict_array`.
+
+        The lags and the predictions share one buffer and the lags of each
+        hour are a view of it, so nothing is rebuilt between hours. Negative
+        predictions are fed back as 0 rides.
+        """
+        n_rows, n_lags = lags.shape
+        buffer = np.empty((n_rows, n_lags + n_hours), dtype=np.result_type(lags.dtype, np.float32))
+        buffer[:, :n_lags] = lags
+
+        if isinstance(pickup_hour, datetime):
+            pickup_hour = pd.Timestamp(pickup_hour)
+        else:
+            pickup_hour = pd.DatetimeIndex(pickup_hour)
+
+        predictions = np.empty((n_rows, n_hours))
+        for hour in range(n_hours):
+            predictions[:, hour] = self.predict_array(
+                buffer[:, hour:hour + n_lags],
+                pickup_location_id,
+                pickup_hour + timedelta(hours=hour),
+            )
+            buffer[:, n_lags + hour] = np.maximum(predictions[:, hour], 0)
+
+        return predictions
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """
+        Same as `Pipeline.predict` on the output of
+        `inference.load_batch_of_features_from_store`
+        """
+        return self.predict_array(
+            features[self.lag_columns].to_numpy(),
+            features['pickup_location_id'].to_numpy(),
+            features['pickup_hour'],
+        )
@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, Optional, Tuple
+
+import joblib
+
+from paths import MODEL_CACHE_DIR
+
+# models already loaded by this process, by (name, version, sha256 of the artifact)
+_loaded_models: Dict[Tuple[str, int, str], object] = {}
+_loaded_models_lock = Lock()
+
+
+def _sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024*1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _try_lock(fd: int) -> bool:
+    """Non-blocking exclusive lock of the open file `fd`, True if it was acquired"""
+    try:
+        import fcntl
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        # Windows
+        import msvcrt
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+    except BlockingIOError:
+        return False
+    return True
+
+
+@contextmanager
+def _file_lock(path: Path, timeout: float = 600):
+    """
+    Cross-process lock on `path`. The OS releases it when the holder closes
+    the file or dies, so a crashed process never leaves it behind.
+    """
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)
+    try:
+        start = monotonic()
+        while not _try_lock(fd):
+            if monotonic() - start > timeout:
+                raise Exception(f'Timed out waiting for the lock {path}')
+            sleep(0.1)
+        yield
+    finally:
+        # closing the file releases the lock, the file itself is kept
+        os.close(fd)
+
+
+def _read_manifest(model_dir: Path) -> Optional[dict]:
+    try:
+        return json.loads((model_dir / 'manifest.json').read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _is_valid(model_path: Path, manifest: Optional[dict]) -> bool:
+    """Whether the local copy is complete and matches its manifest"""
+    return manifest is not None and model_path.exists() and \
+        _sha256(model_path) == manifest['sha256']
+
+
+def load_model(
+    name: str,
+    version: int,
+    get_model_registry: Callable,
+    mmap_mode: Optional[str] = None,
+    cache_dir: Path = MODEL_CACHE_DIR,
+):
+    """
+    Loads the `model.pkl` artifact of model `name`, `version` from the model
+    registry returned by `get_model_registry()`, going through 2 caches:
+
+    - the models already loaded by this process, returned as they are
+    - a local copy of the artifact in `cache_dir/name/version`, with a
+      manifest holding its sha256, so warm starts need no network at all
+
+    A valid local copy is loaded without any lock. The artifact is downloaded
+    only when there is none, under a file lock so that concurrent processes
+    download it once. `mmap_mode` is passed to `joblib.load`, to memory-map
+    the numpy arrays in the artifact.
+    """
+    model_dir = Path(cache_dir) / name / str(version)
+    model_path = model_dir / 'model.pkl'
+
+    manifest = _read_manifest(model_dir)
+    if manifest is not None:
+        key = (name, version, manifest['sha256'])
+        with _loaded_models_lock:
+            if key in _loaded_models:
+                return _loaded_models[key]
+
+    if _is_valid(model_path, manifest):
+        print(f'Model {name} version {version} was already in local storage')
+        model = joblib.load(model_path, mmap_mode=mmap_mode)
+        with _loaded_models_lock:
+            _loaded_models[(name, version, manifest['sha256'])] = model
+        return model
+
+    model_dir.mkdir(parents=True, exist_ok=True)
+    with _file_lock(model_dir / '.lock'):
+
+        # the local copy may have been written by another process meanwhile
+        manifest = _read_manifest(model_dir)
+        if not _is_valid(model_path, manifest):
+
+            print(f'Downloading model {name} version {version} from the registry')
+            registry_model = get_model_registry().get_model(name=name, version=version)
+            download_dir = registry_model.download()
+
+            # copy, then rename, so the local copy is never half written
+            with tempfile.NamedTemporaryFile(dir=model_dir, delete=False) as tmp:
+                with open(Path(download_dir) / 'model.pkl', 'rb') as src:
+                    shutil.copyfileobj(src, tmp)
+            os.replace(tmp.name, model_path)
+
+            # the manifest too, since it is read without the lock
+            manifest = {'name': name, 'version': version, 'sha256': _sha256(model_path)}
+            tmp_manifest_path = model_dir / 'manifest.json.tmp'
+            tmp_manifest_path.write_text(json.dumps(manifest))
+            os.replace(tmp_manifest_path, model_dir / 'manifest.json')
+        else:
+            print(f'Model {name} version {version} was already in local storage')
+
+        model = joblib.load(model_path, mmap_mode=mmap_mode)
+
+    with _loaded_models_lock:
+        _loaded_models[(name, version, manifest['sha256'])] = model
+
+    return model
+
+
+def clear_loaded_models():
+    """Forgets the models loaded by this process, the local copies are kept"""
+    with _loaded_models_lock:
+        _loaded_models.clear()
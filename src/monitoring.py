@@ -1,66 +1,153 @@
 from datetime import datetime, timedelta
 from argparse import ArgumentParser
+from typing import List, Optional
 
 import pandas as pd
 
-import config as config
-
-from config import FEATURE_GROUP_PREDICTIONS_METADATA, FEATURE_GROUP_METADATA
-from feature_store_api import get_or_create_feature_group, get_feature_store
+from config import (
+    FEATURE_GROUP_PREDICTIONS_METADATA,
+    FEATURE_GROUP_METADATA,
+    FEATURE_GROUP_MONITORING_METADATA,
+    FEATURE_GROUP_MONITORING_LOCATIONS_METADATA,
+)
+from feature_store_api import read_time_range, upsert_features
 
 def load_predictions_and_actual_values_from_store(
     from_date: datetime,
     to_date: datetime,
+    location_ids: Optional[List[int]] = None,
 ) -> pd.DataFrame:
+    """
+    Predicted and actual rides of every (pickup_hour, pickup_location_id)
+    with `from_date <= pickup_hour <= to_date`, of the `location_ids` if
+    given.
+
+    Both feature groups are read for exactly that range, and joined here on
+    their primary key.
+    """
+    predictions = read_time_range(FEATURE_GROUP_PREDICTIONS_METADATA, from_date, to_date,
+                                  location_ids)
+    actuals = read_time_range(FEATURE_GROUP_METADATA, from_date, to_date, location_ids,
+                              features=['pickup_location_id', 'pickup_hour', 'rides'])
+
+    # join the 2 features groups by `pickup_hour` and `pickup_location_id`
+    monitoring_df = predictions.merge(actuals, on=['pickup_hour', 'pickup_location_id'])
 
-    # 2 feature groups we need to merge
-    predictions_fg = get_or_create_feature_group(FEATURE_GROUP_PREDICTIONS_METADATA)
-    actuals_fg = get_or_create_feature_group(FEATURE_GROUP_METADATA)
-
-    # query to join the 2 features groups by `pickup_hour` and `pickup_location_id`
-    from_ts = int(from_date.timestamp() * 1000)
-    to_ts = int(to_date.timestamp() * 1000)
-    query = predictions_fg.select_all() \
-        .join(actuals_fg.select(['pickup_location_id', 'pickup_hour', 'rides']),
-              on=['pickup_hour', 'pickup_location_id'], prefix=None) \
-        .filter(predictions_fg.pickup_hour >= from_ts) \
-        .filter(predictions_fg.pickup_hour <= to_ts)
-    
-    # breakpoint()
-
-    # create the feature view `config.FEATURE_VIEW_MONITORING` if it does not
-    # exist yet
-    feature_store = get_feature_store()
-    try:
-        # create feature view as it does not exist yet
-        feature_store.create_feature_view(
-            name='monitoring_feature_view1',
-            version=config.MONITORING_FV_VERSION,
-            query=query
-        )
-    except:
-        print('Feature view already existed. Skip creation.') #fix
-
-    # feature view
-    monitoring_fv = feature_store.get_feature_view(
-        name='monitoring_feature_view1',
-        version=config.MONITORING_FV_VERSION
-    )
-    
-    # fetch data form the feature view
-    # fetch predicted and actual values for the last 30 days
-    monitoring_df = monitoring_fv.get_batch_data(
-        start_time=from_date - timedelta(days=7),
-        end_time=to_date + timedelta(days=7),
-    )
-
-    # filter data to the time period we are interested in
-    pickup_ts_from = int(from_date.timestamp() * 1000)
-    pickup_ts_to = int(to_date.timestamp() * 1000)
-    monitoring_df = monitoring_df[monitoring_df.pickup_ts.between(pickup_ts_from, pickup_ts_to)]
+    monitoring_df.attrs['rows_fetched'] = \
+        predictions.attrs['rows_fetched'] + actuals.attrs['rows_fetched']
+    monitoring_df.attrs['rows_used'] = len(monitoring_df)
 
     return monitoring_df
 
+def get_monitoring_rollup_watermark(
+    to_hour: datetime,
+    lookback: timedelta = timedelta(days=2),
+) -> Optional[pd.Timestamp]:
+    """
+    Newest `pickup_hour` in the monitoring rollup within `lookback` before
+    `to_hour`, None if there is none, e.g. before the first insert, when the
+    feature group is not even saved
+    """
+    rollup = read_time_range(FEATURE_GROUP_MONITORING_METADATA, to_hour - lookback, to_hour,
+                             features=['pickup_hour'])
+    if rollup.empty:
+        return None
+    return pd.to_datetime(rollup['pickup_hour'], utc=True).max()
+
+def update_monitoring_rollup(
+    to_hour: datetime,
+    late_arrival_lookback: timedelta = timedelta(hours=3),
+    initial_lookback: timedelta = timedelta(days=14),
+    wait_for_job: bool = False,
+) -> int:
+    """
+    Joins the predictions and actual rides of the hours since the watermark
+    of the monitoring rollup, up to `to_hour`, and writes their error sums
+    per (pickup_hour, pickup_location_id) into the locations rollup feature
+    group, then their sums per pickup_hour, one row per hour, into the
+    rollup feature group, whose hours are the watermark.
+
+    The `late_arrival_lookback` hours before the watermark are recomputed
+    too, since the feature pipeline may still change their rides, and only
+    the rows that changed are written. Without a watermark, e.g. on the first
+    run, the `initial_lookback` before `to_hour` is rolled up. Returns the
+    number of rows written.
+    """
+    from metrics import get_error_sums, SUM_COLUMNS
+
+    to_hour = pd.to_datetime(to_hour, utc=True).floor('H')
+    watermark = get_monitoring_rollup_watermark(to_hour)
+    from_hour = to_hour - initial_lookback if watermark is None \
+        else watermark - late_arrival_lookback
+    print(f'Rolling up monitoring metrics from {from_hour} to {to_hour} ({watermark=})')
+
+    monitoring_df = load_predictions_and_actual_values_from_store(from_hour, to_hour)
+    if monitoring_df.empty:
+        return 0
+
+    # the sums are additive, so the hourly ones add up the ones per location
+    location_sums = get_error_sums(monitoring_df, ['pickup_hour', 'pickup_location_id'])[SUM_COLUMNS]
+    hour_sums = location_sums.groupby(level='pickup_hour').sum()
+
+    n_rows = 0
+    for metadata, sums in [(FEATURE_GROUP_MONITORING_LOCATIONS_METADATA, location_sums),
+                           (FEATURE_GROUP_MONITORING_METADATA, hour_sums)]:
+        sums = sums.reset_index()
+        sums[['n', 'n_nonzero']] = sums[['n', 'n_nonzero']].astype('int64')
+        n_rows += upsert_features(metadata, sums, wait_for_job=wait_for_job)
+    return n_rows
+
+def load_monitoring_rollup_from_store(
+    from_date: datetime,
+    to_date: datetime,
+) -> pd.DataFrame:
+    """
+    Error sums of all locations with `from_date <= pickup_hour <= to_date`,
+    indexed by pickup_hour, for `metrics.get_metrics_from_sums`
+    """
+    from metrics import SUM_COLUMNS
+
+    rollup = read_time_range(FEATURE_GROUP_MONITORING_METADATA, from_date, to_date)
+    if rollup.empty:
+        rollup = pd.DataFrame(columns=['pickup_hour'] + SUM_COLUMNS)
+    rollup['pickup_hour'] = pd.to_datetime(rollup['pickup_hour'], utc=True)
+    return rollup.set_index('pickup_hour')[SUM_COLUMNS].sort_index()
+
+def load_locations_monitoring_rollup_from_store(
+    from_date: datetime,
+    to_date: datetime,
+    location_ids: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """
+    Error sums with `from_date <= pickup_hour <= to_date` of the
+    `location_ids` if given, indexed by (pickup_hour, pickup_location_id),
+    for `metrics.compute_metrics_from_sums`
+    """
+    from metrics import SUM_COLUMNS
+
+    rollup = read_time_range(FEATURE_GROUP_MONITORING_LOCATIONS_METADATA, from_date, to_date,
+                             location_ids)
+    if rollup.empty:
+        rollup = pd.DataFrame(columns=['pickup_hour', 'pickup_location_id'] + SUM_COLUMNS)
+    rollup['pickup_hour'] = pd.to_datetime(rollup['pickup_hour'], utc=True)
+    return rollup.set_index(['pickup_hour', 'pickup_location_id'])[SUM_COLUMNS].sort_index()
+
+def get_top_locations(
+    to_date: datetime,
+    n_locations: int = 10,
+    lookback: timedelta = timedelta(days=1),
+) -> List[int]:
+    """
+    The `n_locations` locations with the most rides in the `lookback` before
+    `to_date`, from the locations rollup
+    """
+    rides = read_time_range(FEATURE_GROUP_MONITORING_LOCATIONS_METADATA, to_date - lookback,
+                            to_date, features=['pickup_location_id', 'pickup_hour', 'rides'])
+    if rides.empty:
+        return []
+    return rides.groupby('pickup_location_id')['rides'].sum() \
+        .nlargest(n_locations).index.tolist()
+
 if __name__ == '__main__':
 
     # parse command line arguments
@@ -74,4 +161,4 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
 
-    monitoring_df = load_predictions_and_actual_values_from_store()
\ No newline at end of file
+    monitoring_df = load_predictions_and_actual_values_from_store(args.from_date, args.to_date)
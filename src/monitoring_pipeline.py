@@ -0,0 +1,52 @@
+"""
+Monitoring pipeline: once the feature pipeline has stored the actual rides
+of the last hours, joins them with the predictions of the same hours and
+adds their error sums to the monitoring rollup the dashboard reads.
+
+    python src/monitoring_pipeline.py [--current-date 2023-02-28T09:00]
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Optional
+
+from timing import StageTimer
+
+
+def run(
+    current_date: Optional[datetime] = None,
+    wait_for_job: bool = False,
+):
+    """
+    Rolls up the hours since the previous run, up to the one before
+    `current_date`, by default the current hour, the last one with all its
+    rides
+    """
+    import pandas as pd
+
+    timer = StageTimer('monitoring pipeline')
+
+    if current_date is None:
+        current_date = datetime.utcnow()
+    current_date = pd.to_datetime(current_date).floor('H')
+    print(f'{current_date=}')
+
+    with timer.stage('update monitoring rollup'):
+        from monitoring import update_monitoring_rollup
+        n_rows = update_monitoring_rollup(current_date - timedelta(hours=1),
+                                          wait_for_job=wait_for_job)
+    print(f'{n_rows} rows of the monitoring rollup written')
+
+    timer.report()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--current-date', type=datetime.fromisoformat, default=None,
+                        help='UTC hour of the run, by default the current one')
+    parser.add_argument('--wait-for-job', action='store_true',
+                        help='wait for the Hopsworks materialization job to finish')
+    args = parser.parse_args()
+
+    run(current_date=args.current_date, wait_for_job=args.wait_for_job)
@@ -1,7 +1,6 @@
 #we usep paths so we know where we store our data
 
 from pathlib import Path
-import os 
 
 PARENT_DIR = Path(__file__).parent.resolve().parent
 # PARENT_DIR = 'C:\Projects\taxi_predicts'
@@ -10,18 +9,21 @@ RAW_DATA_DIR = DATA_DIR/'raw'
 TRANSFORMED_DATA_DIR = DATA_DIR/'transformed'
 
 MODELS_DIR = PARENT_DIR / 'models'
+# local copies of the models we load from the model registry
+MODEL_CACHE_DIR = MODELS_DIR / 'registry'
 
-if not Path(DATA_DIR).exists():
-    os.mkdir(DATA_DIR)
+# local copy of the features we read from the feature store
+FEATURE_STORE_CACHE_DIR = DATA_DIR / 'feature_store_cache'
 
-if not Path(RAW_DATA_DIR).exists():
-    os.mkdir(RAW_DATA_DIR)
-
-if not Path(TRANSFORMED_DATA_DIR).exists():
-    os.mkdir(TRANSFORMED_DATA_DIR)
-
-if not Path(MODELS_DIR).exists():
-    os.mkdir(MODELS_DIR)
+# cross-validation folds and Optuna study of the hyper-parameter search
+TRAINING_CACHE_DIR = DATA_DIR / 'training_cache'
+OPTUNA_JOURNAL_PATH = MODELS_DIR / 'optuna_journal.log'
 
+# time-series and checkpoints of the prediction backfills
+BACKFILL_DIR = DATA_DIR / 'backfill'
 
+# feature groups and views of `local_feature_store`
+LOCAL_FEATURE_STORE_DIR = DATA_DIR / 'local_feature_store'
 
+# simplified geometry of the taxi zones for the maps of the frontends
+GEOMETRY_CACHE_DIR = DATA_DIR / 'geometry_cache'
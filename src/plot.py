@@ -1,8 +1,11 @@
-from typing import Optional, List
+from typing import TYPE_CHECKING, Optional, List
 from datetime import timedelta
 
+import numpy as np
 import pandas as pd
-import plotly.express as px 
+
+if TYPE_CHECKING:
+    import geopandas as gpd
 
 def plot_one_sample(
     example_id: int,
@@ -12,6 +15,8 @@ def plot_one_sample(
     display_title: Optional[bool] = True,
 ):
     """"""
+    import plotly.express as px
+
     features_ = features.iloc[example_id]
     
     if targets is not None:
@@ -58,6 +63,8 @@ def plot_ts(
     """
     Plot time-series data
     """
+    import plotly.express as px
+
     ts_data_to_plot = ts_data[ts_data.pickup_location_id.isin(locations)] if locations else ts_data
 
     fig = px.line(
@@ -68,4 +75,105 @@ def plot_ts(
         template='none',
     )
 
-    fig.show()
\ No newline at end of file
+    fig.show()
+
+# colors of the maps, as RGB stops evenly spaced from the lowest to the
+# highest value
+COLORMAPS = {
+    'green': [(0, 0, 0), (0, 255, 0)],
+    'viridis': [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)],
+    'magma': [(0, 0, 4), (81, 18, 124), (183, 55, 121), (252, 137, 97), (252, 253, 191)],
+}
+
+
+def get_fill_colors(
+    values: np.ndarray,
+    colormap: str = 'green',
+    alpha: int = 255,
+    vmin: Optional[float] = None,
+    vmax: Optional[float] = None,
+) -> np.ndarray:
+    """
+    (n, 4) uint8 array with the RGBA colors of `values` in `colormap`,
+    scaled from `vmin` to `vmax`, by default the lowest and highest values.
+    If they are equal all values get the first color, and so do NaNs,
+    infinite values get the first or last one.
+    """
+    if colormap not in COLORMAPS:
+        raise Exception(f'Unknown colormap {colormap}, use one of {list(COLORMAPS)}')
+    stops = np.asarray(COLORMAPS[colormap], dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+
+    finite = values[np.isfinite(values)]
+    if vmin is None:
+        vmin = finite.min() if len(finite) else 0.0
+    if vmax is None:
+        vmax = finite.max() if len(finite) else 0.0
+    span = vmax - vmin
+
+    # position of each value between 0 and the last stop
+    scaled = np.zeros(len(values))
+    if np.isfinite(span) and span > 0:
+        np.divide(values - vmin, span, out=scaled, where=~np.isnan(values))
+    scaled = np.clip(scaled, 0, 1) * (len(stops) - 1)
+
+    lower = np.minimum(scaled.astype(int), len(stops) - 2)
+    weight = (scaled - lower)[:, None]
+    colors = np.empty((len(values), 4), dtype=np.uint8)
+    colors[:, :3] = np.rint(stops[lower] * (1 - weight) + stops[lower + 1] * weight)
+    colors[:, 3] = alpha
+    return colors
+
+
+def get_map_data(
+    zones: 'gpd.GeoDataFrame',
+    predictions: pd.DataFrame,
+    colormap: str = 'green',
+) -> dict:
+    """
+    GeoJSON of the `zones` with predictions, with only the properties the map
+    shows: LocationID, zone, predicted_demand and its fill_color
+    """
+    map_df = zones[['LocationID', 'zone', 'geometry']].merge(
+        predictions[['pickup_location_id', 'predicted_demand']],
+        left_on='LocationID', right_on='pickup_location_id'
+    ).drop(columns='pickup_location_id')
+    map_df['fill_color'] = get_fill_colors(map_df['predicted_demand'].to_numpy(), colormap).tolist()
+    return map_df.__geo_interface__
+
+
+def plot_predictions_map(map_data: dict):
+    """pydeck map of NYC with the zones of `get_map_data`"""
+    import pydeck as pdk
+
+    initial_view_state = pdk.ViewState(
+        latitude=40.7831,
+        longitude=-73.9712,
+        zoom=11,
+        max_zoom=16,
+        pitch=45,
+        bearing=0
+    )
+
+    geojson = pdk.Layer(
+        "GeoJsonLayer",
+        map_data,
+        opacity=0.25,
+        stroked=False,
+        filled=True,
+        extruded=False,
+        wireframe=True,
+        get_elevation=10,
+        get_fill_color="properties.fill_color",
+        get_line_color=[255, 255, 255],
+        auto_highlight=True,
+        pickable=True,
+    )
+
+    tooltip = {"html": "<b>Zone:</b> [{LocationID}]{zone} <br /> <b>Predicted rides:</b> {predicted_demand}"}
+
+    return pdk.Deck(
+        layers=[geojson],
+        initial_view_state=initial_view_state,
+        tooltip=tooltip
+    )
@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict
+
+
+class StageTimer:
+    """
+    Wall-clock time of the stages of a pipeline run, e.g.
+
+        timer = StageTimer('inference pipeline')
+        with timer.stage('load features'):
+            features = load_batch_of_features_from_store(current_date)
+        timer.report()
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.timings: Dict[str, float] = {}
+        self._start = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + perf_counter() - start
+            print(f'[{self.name}] {name}: {self.timings[name]:.2f}s')
+
+    def report(self):
+        """Prints the time and share of the total of every stage"""
+        total = perf_counter() - self._start
+        print(f'[{self.name}] {total:.2f}s in total')
+        for name, seconds in self.timings.items():
+            print(f'{name:>30} | {seconds:>8.2f}s | {100 * seconds / total:>5.1f}%')
@@ -0,0 +1,260 @@
+"""
+Hyper-parameter search for the model of `model.get_pipeline`.
+
+The cross-validation folds are engineered and binned once into LightGBM
+binary Datasets, and the Optuna trials run in parallel worker processes that
+share a journal file storage, e.g.
+
+    study = search_hyperparameters(x_train, y_train, n_trials=100, n_jobs=4)
+    pipeline = get_pipeline(**get_best_params(study)).fit(x_train, y_train)
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import TimeSeriesSplit
+import lightgbm as lgb
+import optuna
+
+from model import get_model_input_columns
+from feature_engineering import FeaturesEngineer
+from paths import TRAINING_CACHE_DIR, OPTUNA_JOURNAL_PATH
+
+# binning parameters, fixed when the fold Datasets are built and shared by
+# all trials
+DATASET_PARAMS = {
+    'max_bin': 255,
+    # otherwise LightGBM drops the features that cannot be split with the
+    # `min_child_samples` of the first trial, for all the other trials
+    'feature_pre_filter': False,
+    'verbose': -1,
+}
+
+# trials counted in `n_trials`
+_FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+
+def suggest_hyperparams(trial: optuna.trial.Trial) -> Dict:
+    """Search space of the LightGBM hyper-parameters"""
+    return {
+        "num_leaves": trial.suggest_int("num_leaves", 2, 256),
+        "feature_fraction": trial.suggest_float("feature_fraction", 0.2, 1.0),
+        "bagging_fraction": trial.suggest_float("bagging_fraction", 0.2, 1.0),
+        "min_child_samples": trial.suggest_int("min_child_samples", 3, 100),
+    }
+
+
+def build_cv_datasets(
+    features: pd.DataFrame,
+    targets: pd.Series,
+    n_splits: int = 4,
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+    cache_dir: Path = TRAINING_CACHE_DIR,
+) -> List[Tuple[Path, Path]]:
+    """
+    Engineers the model input of each `TimeSeriesSplit` fold of the data,
+    sorted by `pickup_hour`, and saves it as (train, validation) LightGBM
+    binary Datasets in `cache_dir`.
+
+    The validation Datasets reuse the bins of their training Dataset, and
+    the raw matrices are freed once binned, so trials only load the binary
+    files.
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # TimeSeriesSplit needs the rows in time order
+    order = np.argsort(features['pickup_hour'].to_numpy(), kind='stable')
+    features = features.iloc[order]
+    targets = np.asarray(targets)[order]
+
+    # the transformers only see each row once, for all folds and trials
+    x = FeaturesEngineer(lag_averages).transform(features)
+    feature_name = get_model_input_columns(
+        sum(1 for c in features.columns if c.startswith('rides_previous_')), lag_averages)
+
+    paths = []
+    for fold, (train_index, val_index) in enumerate(TimeSeriesSplit(n_splits=n_splits).split(x)):
+        train_path = cache_dir / f'fold_{fold}_train.bin'
+        val_path = cache_dir / f'fold_{fold}_val.bin'
+        for path in (train_path, val_path):
+            path.unlink(missing_ok=True)
+
+        train_set = lgb.Dataset(
+            x.iloc[train_index], label=targets[train_index], feature_name=feature_name,
+            params=DATASET_PARAMS, free_raw_data=True)
+        val_set = lgb.Dataset(
+            x.iloc[val_index], label=targets[val_index], feature_name=feature_name,
+            reference=train_set, params=DATASET_PARAMS, free_raw_data=True)
+        train_set.save_binary(str(train_path))
+        val_set.save_binary(str(val_path))
+        paths.append((train_path, val_path))
+
+    print(f'Saved {n_splits} cross-validation folds of {len(x)} rows to {cache_dir}')
+    return paths
+
+
+def _get_journal_storage(path: Path) -> optuna.storages.JournalStorage:
+    """Optuna storage in a local journal file, safe to share between processes"""
+    try:
+        from optuna.storages.journal import JournalFileBackend, JournalFileOpenLock
+    except ImportError:
+        # optuna < 4.0
+        from optuna.storages import JournalFileStorage as JournalFileBackend
+        from optuna.storages import JournalFileOpenLock
+
+    return optuna.storages.JournalStorage(
+        JournalFileBackend(str(path), lock_obj=JournalFileOpenLock(str(path))))
+
+
+def _objective(
+    trial: optuna.trial.Trial,
+    fold_paths: List[Tuple[Path, Path]],
+    num_boost_round: int,
+    num_threads: int,
+) -> float:
+    """
+    Average validation MAE of the trial hyper-parameters over the folds.
+    The trial is pruned after any fold if its average so far is worse than
+    the median of the previous trials.
+    """
+    params = {
+        **DATASET_PARAMS,
+        'objective': 'regression',
+        'metric': 'mae',
+        'num_threads': num_threads,
+        **suggest_hyperparams(trial),
+    }
+
+    scores = []
+    for fold, (train_path, val_path) in enumerate(fold_paths):
+        train_set = lgb.Dataset(str(train_path), params=DATASET_PARAMS)
+        val_set = lgb.Dataset(str(val_path), reference=train_set, params=DATASET_PARAMS)
+
+        evals_result = {}
+        lgb.train(
+            params, train_set,
+            num_boost_round=num_boost_round,
+            valid_sets=[val_set], valid_names=['val'],
+            callbacks=[lgb.record_evaluation(evals_result)],
+        )
+        scores.append(evals_result['val']['l1'][-1])
+
+        trial.report(float(np.mean(scores)), step=fold)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    return float(np.mean(scores))
+
+
+def _run_worker(
+    study_name: str,
+    storage_path: Path,
+    fold_paths: List[Tuple[Path, Path]],
+    n_trials: int,
+    num_boost_round: int,
+    num_threads: int,
+):
+    """Runs trials of the shared study until it has `n_trials` in total"""
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=_get_journal_storage(storage_path),
+        pruner=optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=0),
+    )
+    study.optimize(
+        lambda trial: _objective(trial, fold_paths, num_boost_round, num_threads),
+        callbacks=[optuna.study.MaxTrialsCallback(n_trials, states=_FINISHED_STATES)],
+    )
+
+
+def get_study_name(features: pd.DataFrame, n_splits: int) -> str:
+    """
+    Name of the study of the training data `features` and `n_splits` folds.
+    Trials are only comparable on the same folds, so every data window has
+    its own study.
+    """
+    first_hour, last_hour = features['pickup_hour'].min(), features['pickup_hour'].max()
+    return f'taxi_demand_predictor_next_hour_{first_hour:%Y%m%d%H}_{last_hour:%Y%m%d%H}_' \
+        f'{n_splits}_folds'
+
+
+def get_best_params(study: optuna.Study) -> Dict:
+    """
+    Hyper-parameters of the best trial of `study`, or none, so the model
+    defaults are used, if no trial completed
+    """
+    if not study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)):
+        print(f'No trial of {study.study_name} completed, using the default hyper-parameters')
+        return {}
+    return study.best_params
+
+
+def search_hyperparameters(
+    features: pd.DataFrame,
+    targets: pd.Series,
+    n_trials: int = 10,
+    n_jobs: int = 1,
+    n_splits: int = 4,
+    lag_averages: Optional[Dict[str, List[int]]] = None,
+    num_boost_round: int = 100,
+    study_name: Optional[str] = None,
+    storage_path: Path = OPTUNA_JOURNAL_PATH,
+    cache_dir: Path = TRAINING_CACHE_DIR,
+) -> optuna.Study:
+    """
+    Searches the LightGBM hyper-parameters with the lowest average validation
+    MAE over `n_splits` `TimeSeriesSplit` folds, running `n_trials` trials
+    in `n_jobs` worker processes.
+
+    The study is kept in the journal file at `storage_path`, so a search with
+    the same `study_name` resumes the previous one and adds `n_trials` more.
+    By default the name is `get_study_name`, so only a search on the same
+    training data resumes, and a new data window starts a new study.
+    Trials worse than the median after any fold, from the first one on, are
+    pruned.
+
+    Trials are counted when they finish, so with `n_jobs` workers up to
+    `n_jobs - 1` more trials than `n_trials` may run, the ones already
+    started when the last counted one finishes.
+    """
+    if study_name is None:
+        study_name = get_study_name(features, n_splits)
+    # folds of their own, so searches on other windows never overwrite them
+    fold_paths = build_cv_datasets(features, targets, n_splits, lag_averages,
+                                   Path(cache_dir) / study_name)
+
+    Path(storage_path).parent.mkdir(parents=True, exist_ok=True)
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=_get_journal_storage(storage_path),
+        direction='minimize',
+        load_if_exists=True,
+    )
+    # `MaxTrialsCallback` counts the finished trials of previous searches too
+    n_trials += len(study.get_trials(deepcopy=False, states=_FINISHED_STATES))
+
+    # LightGBM threads are split between the workers
+    num_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    if n_jobs == 1:
+        _run_worker(study_name, storage_path, fold_paths, n_trials, num_boost_round, num_threads)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [
+                executor.submit(_run_worker, study_name, storage_path, fold_paths,
+                                n_trials, num_boost_round, num_threads)
+                for _ in range(n_jobs)
+            ]
+            for future in futures:
+                future.result()
+
+    study = optuna.load_study(study_name=study_name, storage=_get_journal_storage(storage_path))
+    n_pruned = sum(t.state == optuna.trial.TrialState.PRUNED for t in study.trials)
+    best_params = get_best_params(study)
+    best_value = f'{study.best_value:.4f}' if best_params else None
+    print(f'{study_name}: {len(study.trials)} trials, {n_pruned} pruned, best MAE {best_value} '
+          f'with {best_params}')
+    return study
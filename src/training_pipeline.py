@@ -0,0 +1,117 @@
+"""
+Training pipeline, from notebook 13: searches the hyper-parameters of the
+model on the time-series in the feature store, evaluates it on the last 4
+weeks and saves it, and optionally pushes it to the model registry.
+
+    python src/training_pipeline.py [--n-trials 10] [--n-jobs 4] [--register]
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Optional
+
+from timing import StageTimer
+
+
+def run(
+    n_trials: int = 10,
+    n_jobs: int = 1,
+    cutoff_date: Optional[datetime] = None,
+    register: bool = False,
+):
+    """
+    Trains the model on the features before `cutoff_date`, by default 28 days
+    ago, and reports its MAE on the ones after it.
+    """
+    import pandas as pd
+
+    timer = StageTimer('training pipeline')
+
+    with timer.stage('load time-series data'):
+        import config as config
+        from feature_store_api import get_or_create_feature_view
+        feature_view = get_or_create_feature_view(config.FEATURE_VIEW_METADATA)
+        ts_data, _ = feature_view.training_data(
+            description='Time-series hourly taxi rides'
+        )
+        ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'], inplace=True)
+
+    with timer.stage('transform into features and targets'):
+        from data import transform_ts_data_into_features_and_target
+        features, targets = transform_ts_data_into_features_and_target(
+            ts_data,
+            input_seq_len=config.N_FEATURES,
+            step_size=23
+        )
+        features_and_target = features.copy()
+        features_and_target['target_rides_next_hour'] = targets
+
+    # we are taking the data from today until one month ago and split it
+    if cutoff_date is None:
+        cutoff_date = pd.Timestamp.today().normalize() - timedelta(days=28)
+    print(f'{cutoff_date=}')
+
+    from data_split import train_test_split
+    x_train, y_train, x_test, y_test = train_test_split(
+        features_and_target,
+        cutoff_date,
+        target_column_name='target_rides_next_hour'
+    )
+    print(f'{x_train.shape=}')
+    print(f'{x_test.shape=}')
+
+    with timer.stage('search hyper-parameters'):
+        from training import get_best_params, search_hyperparameters
+        study = search_hyperparameters(x_train, y_train, n_trials=n_trials, n_jobs=n_jobs)
+
+    with timer.stage('train model'):
+        from model import get_pipeline
+        pipeline = get_pipeline(**get_best_params(study))
+        pipeline.fit(x_train, y_train)
+
+    with timer.stage('evaluate model'):
+        from sklearn.metrics import mean_absolute_error
+        test_mae = mean_absolute_error(y_test, pipeline.predict(x_test))
+    print(f'{test_mae=:.4f}')
+
+    with timer.stage('save model'):
+        import joblib
+        from paths import MODELS_DIR
+        model_path = MODELS_DIR / 'model.pkl'
+        joblib.dump(pipeline, model_path)
+
+    if register:
+        with timer.stage('push to model registry'):
+            from hsml.schema import Schema
+            from hsml.model_schema import ModelSchema
+            from feature_store_api import get_model_registry
+
+            model_schema = ModelSchema(input_schema=Schema(x_train),
+                                       output_schema=Schema(y_train))
+            model = get_model_registry().sklearn.create_model(
+                name=config.MODEL_NAME,
+                metrics={'test_mae': test_mae},
+                description='LightGBM regressor with a bit of hyper-parameter tuning',
+                input_example=x_train.sample(),
+                model_schema=model_schema
+            )
+            model.save(str(model_path))
+
+    timer.report()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-trials', type=int, default=10,
+                        help='number of Optuna trials of the hyper-parameter search')
+    parser.add_argument('--n-jobs', type=int, default=1,
+                        help='number of processes running the trials')
+    parser.add_argument('--cutoff-date', type=datetime.fromisoformat, default=None,
+                        help='first pickup hour of the test set, by default 28 days ago')
+    parser.add_argument('--register', action='store_true',
+                        help='push the model to the Hopsworks model registry')
+    args = parser.parse_args()
+
+    run(n_trials=args.n_trials, n_jobs=args.n_jobs, cutoff_date=args.cutoff_date,
+        register=args.register)